@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+"""Benchmark a squid.conf rendered by the charm against a local origin.
+
+The config is rendered through SquidIngressCacheCharm._get_squid_config
+with the given charm config and cache-settings, adjusted to run from a
+scratch directory, and a local squid is started with it in front of a
+stand-in origin server. Requests for a fixed set of objects are replayed
+with a Zipf-like popularity distribution and the throughput, latency
+percentiles and hit ratio are written out as JSON.
+
+    ./benchmark/benchmark.py --requests 20000 --concurrency 16 \\
+        --charm-config '{"cache_mem": "64 MB"}' --output bench_output.txt
+"""
+
+import argparse
+import bisect
+import http.client
+import http.server
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lib'), os.path.join(ROOT, 'src')]
+
+from ops.testing import Harness  # noqa: E402
+
+from charm import SquidIngressCacheCharm  # noqa: E402
+
+
+# Where squid keeps the sockets its workers talk to each other over. It is
+# fixed when squid is built so cannot be moved to the scratch directory.
+SQUID_RUN_DIR = '/var/run/squid'
+
+
+def render_config(charm_config, cache_settings, squid_port, manager_port, origin_port,
+                  workdir) -> tuple:
+    """Render squid.conf through the charm and point it at local paths.
+
+    Returns the config and the arguments the charm would start squid with.
+    """
+    harness = Harness(SquidIngressCacheCharm)
+    try:
+        harness.begin()
+        harness.update_config(charm_config)
+        rel_id = harness.add_relation('ingress-proxy', 'website')
+        harness.add_relation_unit(rel_id, 'website/0')
+        relation_data = {
+            'service-hostname': 'bench.local',
+            'service-name': 'website',
+            'service-port': str(origin_port)}
+        if cache_settings:
+            relation_data['cache-settings'] = json.dumps(cache_settings)
+        harness.update_relation_data(rel_id, 'website', relation_data)
+        with patch.object(
+                SquidIngressCacheCharm,
+                '_get_cache_peers',
+                return_value=['127.0.0.1']):
+            squid_config = harness.charm._get_squid_config()
+        squid_args = harness.charm._get_squid_command().split()[1:]
+    finally:
+        harness.cleanup()
+    squid_config = squid_config.replace(SquidIngressCacheCharm.SQUID_CACHE_DIR, workdir)
+    squid_config = squid_config.replace('include /etc/squid/conf.d/*', '')
+    squid_config = squid_config.replace(
+        f'daemon:{SquidIngressCacheCharm.SQUID_ACCESS_LOG}',
+        f'stdio:{workdir}/access.log')
+    squid_config = squid_config.replace(
+        f'/usr/bin/python3 {SquidIngressCacheCharm.SQUID_STORE_ID_FILE}',
+        f"{sys.executable} {os.path.join(ROOT, 'src', 'store_id.py')}")
+    squid_config = re.sub(
+        rf'^http_port 127\.0\.0\.1:{SquidIngressCacheCharm.SQUID_MANAGER_PORT}$',
+        f'http_port 127.0.0.1:{manager_port}',
+        squid_config,
+        flags=re.MULTILINE)
+    squid_config = re.sub(
+        r'^http_port \d+ accel',
+        f'http_port {squid_port} accel',
+        squid_config,
+        flags=re.MULTILINE)
+    squid_config += '\n'.join([
+        f'pid_filename {workdir}/squid.pid',
+        f'cache_log {workdir}/cache.log',
+        'shutdown_lifetime 0 seconds',
+        ''])
+    return squid_config, squid_args
+
+
+def start_origin(object_size, max_age):
+    """Start a stand-in origin serving /obj/<n> and return the server."""
+    body = b'x' * object_size
+
+    class OriginHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', f'public, max-age={max_age}')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), OriginHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def wait_for_port(port, timeout=30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"squid did not listen on port {port}")
+
+
+def zipf_cum_weights(objects, s) -> list:
+    """Cumulative weights of object popularity, object n has weight 1/n^s."""
+    return list(itertools.accumulate(1 / (n ** s) for n in range(1, objects + 1)))
+
+
+def make_workload(requests, objects, s, seed) -> list:
+    """Return the object ids to request, reproducible for a given seed."""
+    rng = random.Random(seed)
+    cum_weights = zipf_cum_weights(objects, s)
+    total = cum_weights[-1]
+    return [
+        bisect.bisect_left(cum_weights, rng.random() * total) + 1
+        for _ in range(requests)]
+
+
+def percentile(values, pct) -> float:
+    """Nearest rank percentile of already sorted `values`."""
+    if not values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def run_load(squid_port, workload, concurrency) -> dict:
+    """Replay `workload` against squid and return the measurements."""
+    local = threading.local()
+
+    def request(object_id):
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection('127.0.0.1', squid_port, timeout=30)
+        start = time.perf_counter()
+        try:
+            local.conn.request('GET', f'/obj/{object_id}', headers={'Host': 'bench.local'})
+            response = local.conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            local.conn.close()
+            del local.conn
+            return None, False
+        hit = response.getheader('X-Cache', '').startswith('HIT')
+        return time.perf_counter() - start, hit
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(request, workload))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(r[0] for r in results if r[0] is not None)
+    hits = sum(1 for r in results if r[1])
+    return {
+        'requests': len(workload),
+        'errors': len(workload) - len(latencies),
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'hit_ratio': round(hits / len(workload), 4) if workload else 0,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--squid', default=shutil.which('squid') or '/usr/sbin/squid')
+    parser.add_argument('--charm-config', type=json.loads, default={},
+                        help='JSON charm config options')
+    parser.add_argument('--cache-settings', type=json.loads, default={},
+                        help='JSON cache-settings relation data')
+    parser.add_argument('--squid-port', type=int, default=13128)
+    parser.add_argument('--manager-port', type=int, default=13130,
+                        help='Port squid serves the cache manager on')
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--objects', type=int, default=1000)
+    parser.add_argument('--zipf-s', type=float, default=1.0,
+                        help='Zipf exponent, higher is more skewed')
+    parser.add_argument('--object-size', type=int, default=8192)
+    parser.add_argument('--max-age', type=int, default=3600)
+    parser.add_argument('--warmup-requests', type=int, default=0,
+                        help='Requests replayed before measuring')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write results to this file, default stdout')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the scratch directory for inspection')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='squid-bench-')
+    # Squid drops privileges to its own user when started as root.
+    os.chmod(workdir, 0o777)
+    origin = start_origin(args.object_size, args.max_age)
+    config_file = os.path.join(workdir, 'squid.conf')
+    squid_config, squid_args = render_config(
+        args.charm_config,
+        args.cache_settings,
+        args.squid_port,
+        args.manager_port,
+        origin.server_address[1],
+        workdir)
+    if re.search(r'^workers ', squid_config, flags=re.MULTILINE) and \
+            not os.path.isdir(SQUID_RUN_DIR):
+        origin.shutdown()
+        parser.error(
+            f'running several workers needs {SQUID_RUN_DIR} to exist and be '
+            'writable by the squid user')
+    with open(config_file, 'w') as f:
+        f.write(squid_config)
+    squid = None
+    try:
+        if 'cache_dir ' in squid_config:
+            subprocess.run([args.squid, '-z', '-N', '-f', config_file], check=True)
+        squid = subprocess.Popen([args.squid, '-f', config_file] + squid_args)
+        wait_for_port(args.squid_port)
+        if args.warmup_requests:
+            run_load(
+                args.squid_port,
+                make_workload(args.warmup_requests, args.objects, args.zipf_s, args.seed + 1),
+                args.concurrency)
+        results = run_load(
+            args.squid_port,
+            make_workload(args.requests, args.objects, args.zipf_s, args.seed),
+            args.concurrency)
+    finally:
+        if squid:
+            squid.terminate()
+            squid.wait()
+        origin.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report = {
+        'parameters': {
+            k: v for k, v in vars(args).items()
+            if k not in ('output', 'keep', 'squid')},
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
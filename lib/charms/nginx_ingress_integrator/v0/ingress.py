@@ -19,6 +19,7 @@ Import `IngressRequires` in your charm, with two required options:
     - service-namespace
     - session-cookie-max-age
     - tls-secret-name
+    - upstream-hash-by
 
 See [the config section](https://charmhub.io/nginx-ingress-integrator/configure) for descriptions
 of each, along with the required type.
@@ -58,6 +59,11 @@ LIBAPI = 0
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
+#
+# This copy diverges locally from the published LIBPATCH 7: it adds the
+# upstream-hash-by field and the squid cache-settings fields, and
+# IngressRequires.update_config clears optional fields no longer set.
+# `charmcraft fetch-lib` would overwrite these changes.
 LIBPATCH = 7
 
 logger = logging.getLogger(__name__)
@@ -78,9 +84,31 @@ OPTIONAL_INGRESS_RELATION_FIELDS = {
     "tls-secret-name",
     "path-routes",
     "cache-settings",
+    "upstream-hash-by",
 }
 OPTIONAL_CACHE_SETTING_RELATION_FIELDS = {
     "refresh-patterns",
+    "cache-mem",
+    "cache-dir-size",
+    "maximum-object-size",
+    "maximum-object-size-in-memory",
+    "peer-selection",
+    "peer-connect-fail-limit",
+    "peer-connect-timeout",
+    "collapsed-forwarding",
+    "max-stale",
+    "server-persistent-connections",
+    "client-persistent-connections",
+    "server-idle-pconn-timeout",
+    "client-idle-pconn-timeout",
+    "peer-standby",
+    "store-id-strip-params",
+    "store-id-sort-query",
+    "cache-profile",
+    "memory-replacement-policy",
+    "cache-replacement-policy",
+    "range-offset-limit",
+    "cache-dir-min-size",
 }
 JSON_RELATION_FIELDS = {
     "cache-settings"
@@ -163,6 +191,9 @@ class IngressRequires(Object):
             if relation:
                 for key in self.config_dict:
                     relation.data[self.model.app][key] = str(self.config_dict[key])
+                # Clear optional fields which are no longer set.
+                for key in OPTIONAL_INGRESS_RELATION_FIELDS - set(self.config_dict):
+                    relation.data[self.model.app].pop(key, None)
 
 
 class IngressBaseProvides(Object):
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+"""Replay an access log through simulated caches of different sizes.
+
+Each request in the log is fed to one simulated cache per combination of
+size and replacement policy, so a single streamed pass over the log
+gives the object and byte hit ratio of every combination. Objects are
+keyed by a 64 bit hash of their URL and the caches only hold what fits
+in them, so memory use does not grow with the length of the log.
+
+    ./cache_simulator.py --sizes '256 MB,1 GB,4 GB' access.log
+"""
+
+import argparse
+import collections
+import hashlib
+import heapq
+import json
+import re
+import sys
+
+import log_analysis
+
+SIZE_UNITS = {
+    '': 1,
+    'B': 1,
+    'BYTES': 1,
+    'KB': 1024,
+    'MB': 1024 ** 2,
+    'GB': 1024 ** 3,
+    'TB': 1024 ** 4,
+}
+SIZE_RE = re.compile(r'^\s*([0-9.]+)\s*([a-zA-Z]*)\s*$')
+
+POLICIES = ['lru', 'gdsf', 'lfuda']
+
+# Requests for which squid could serve a cached object.
+CACHEABLE_METHODS = {'GET', 'HEAD'}
+# Replies whose size is the size of the object.
+OBJECT_STATUSES = {'200', '206'}
+# Reply to a conditional request for an object the client already has.
+NOT_MODIFIED_STATUS = '304'
+
+
+def parse_size(size) -> int:
+    """Return the number of bytes in a squid size, eg '256 MB'."""
+    match = SIZE_RE.match(str(size))
+    if not match or match.group(2).upper() not in SIZE_UNITS:
+        raise ValueError(f'invalid size {size!r}')
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def url_key(url) -> int:
+    """Return a compact key for `url`, stable across runs."""
+    return int.from_bytes(
+        hashlib.blake2b(url.encode(), digest_size=8).digest(), 'big')
+
+
+class LRUCache:
+    """Evict the least recently used object."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.used = 0
+        self.objects = collections.OrderedDict()
+
+    def request(self, key, size) -> bool:
+        """Look up `key`, caching it on a miss. Returns whether it hit.
+
+        A `size` of None looks up the object without caching it on a miss.
+        """
+        cached = self.objects.get(key)
+        if cached is not None and size in (None, cached):
+            self.objects.move_to_end(key)
+            return True
+        if size is None:
+            return False
+        if cached is not None:
+            # The object changed size, treat it as a new object.
+            self.used -= self.objects.pop(key)
+        if size <= self.capacity:
+            while self.used + size > self.capacity:
+                self.used -= self.objects.popitem(last=False)[1]
+            self.objects[key] = size
+            self.used += size
+        return False
+
+
+class HeapCache:
+    """Evict the object with the lowest priority, like squid's heap policies.
+
+    The cache age L is raised to the priority of each evicted object so
+    objects popular long ago age out. Priorities are kept in a heap with
+    lazy deletion, stale entries are skipped when popped and the heap is
+    rebuilt when they outnumber the cached objects.
+    """
+
+    def __init__(self, capacity, policy):
+        self.capacity = capacity
+        self.policy = policy
+        self.used = 0
+        self.age = 0.0
+        # key: [size, frequency, priority]
+        self.objects = {}
+        self.heap = []
+
+    def _priority(self, size, frequency) -> float:
+        if self.policy == 'gdsf':
+            return self.age + frequency / max(size, 1)
+        return self.age + frequency
+
+    def _evict(self) -> None:
+        while True:
+            priority, key = heapq.heappop(self.heap)
+            cached = self.objects.get(key)
+            if cached and cached[2] == priority:
+                break
+        self.age = priority
+        self.used -= self.objects.pop(key)[0]
+
+    def _push(self, key, cached) -> None:
+        cached[2] = self._priority(cached[0], cached[1])
+        heapq.heappush(self.heap, (cached[2], key))
+        if len(self.heap) > 2 * len(self.objects) + 1024:
+            self.heap = [(c[2], k) for k, c in self.objects.items()]
+            heapq.heapify(self.heap)
+
+    def request(self, key, size) -> bool:
+        """Look up `key`, caching it on a miss. Returns whether it hit.
+
+        A `size` of None looks up the object without caching it on a miss.
+        """
+        cached = self.objects.get(key)
+        if cached and size in (None, cached[0]):
+            cached[1] += 1
+            self._push(key, cached)
+            return True
+        if size is None:
+            return False
+        if cached:
+            self.used -= self.objects.pop(key)[0]
+        if size <= self.capacity:
+            while self.used + size > self.capacity:
+                self._evict()
+            cached = self.objects[key] = [size, 1, 0.0]
+            self.used += size
+            self._push(key, cached)
+        return False
+
+
+def make_cache(capacity, policy):
+    if policy == 'lru':
+        return LRUCache(capacity)
+    if policy in ('gdsf', 'lfuda'):
+        return HeapCache(capacity, policy)
+    raise ValueError(
+        f'unknown policy {policy!r}, valid policies are {", ".join(POLICIES)}')
+
+
+class Simulator:
+    """Replay access log lines through caches of each size and policy.
+
+    If the log format includes the status only 200 and 206 replies are
+    cached, as other replies do not carry the object. A 304 is a hit on
+    the object if it is cached and leaves its size alone.
+    """
+
+    def __init__(self, log_format, sizes, policies=None, max_object_size=None):
+        self.regex = log_analysis.logformat_regex(log_format)
+        if 'url' not in self.regex.groupindex or 'bytes' not in self.regex.groupindex:
+            raise ValueError('log format must include %ru and %<st')
+        self.max_object_size = max_object_size
+        self.caches = [
+            (size, policy, make_cache(parse_size(size), policy))
+            for size in sizes for policy in policies or POLICIES]
+        self.hits = [0] * len(self.caches)
+        self.hit_bytes = [0] * len(self.caches)
+        self.lines = 0
+        self.unparsed = 0
+        self.requests = 0
+        self.bytes = 0
+
+    def add_line(self, line) -> None:
+        self.lines += 1
+        match = self.regex.match(line.rstrip('\n'))
+        if not match:
+            self.unparsed += 1
+            return
+        try:
+            size = int(match.group('bytes'))
+        except ValueError:
+            self.unparsed += 1
+            return
+        self.requests += 1
+        self.bytes += size
+        if 'method' in self.regex.groupindex and \
+                match.group('method') not in CACHEABLE_METHODS:
+            return
+        object_size = size
+        if 'status' in self.regex.groupindex:
+            status = match.group('status')
+            if status == NOT_MODIFIED_STATUS:
+                object_size = None
+            elif status not in OBJECT_STATUSES:
+                return
+        if self.max_object_size and size > self.max_object_size:
+            return
+        key = url_key(match.group('url'))
+        for i, (_, _, cache) in enumerate(self.caches):
+            if cache.request(key, object_size):
+                self.hits[i] += 1
+                self.hit_bytes[i] += size
+
+    def add_lines(self, lines) -> None:
+        for line in lines:
+            self.add_line(line)
+
+    @staticmethod
+    def _ratio(count, total) -> float:
+        return round(count / total, 4) if total else 0
+
+    def report(self) -> dict:
+        """Return the hit ratios of each size and policy."""
+        return {
+            'lines': self.lines,
+            'unparsed': self.unparsed,
+            'requests': self.requests,
+            'results': [
+                {
+                    'size': size,
+                    'policy': policy,
+                    'hit-ratio': self._ratio(self.hits[i], self.requests),
+                    'byte-hit-ratio': self._ratio(self.hit_bytes[i], self.bytes),
+                }
+                for i, (size, policy, _) in enumerate(self.caches)],
+        }
+
+
+def main(args=None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log_file', nargs='?', help='Log to replay, default stdin')
+    parser.add_argument('--log-format', default=(
+        '%>a %ui %un [%tl] "%rm %ru HTTP/%rv" %>Hs %<st '
+        '"%{Referer}>h" "%{User-Agent}>h" %Ss:%Sh'))
+    parser.add_argument('--sizes', default='64 MB,256 MB,1 GB',
+                        help='Comma separated cache sizes')
+    parser.add_argument('--policies', default=','.join(POLICIES),
+                        help='Comma separated replacement policies')
+    parser.add_argument('--max-object-size', default='4 MB',
+                        help='Objects larger than this are not cached')
+    args = parser.parse_args(args)
+    simulator = Simulator(
+        args.log_format,
+        [s.strip() for s in args.sizes.split(',')],
+        [p.strip() for p in args.policies.split(',')],
+        parse_size(args.max_object_size))
+    if args.log_file:
+        with open(args.log_file, encoding='utf-8', errors='replace') as f:
+            simulator.add_lines(f)
+    else:
+        simulator.add_lines(sys.stdin)
+    print(json.dumps(simulator.report(), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
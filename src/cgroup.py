@@ -0,0 +1,85 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+"""Read cgroup resource limits from inside the squid container."""
+
+import logging
+
+from typing import Optional
+
+from ops.pebble import PathError
+
+logger = logging.getLogger(__name__)
+
+# cgroup v2 first, then cgroup v1.
+MEMORY_LIMIT_FILES = [
+    '/sys/fs/cgroup/memory.max',
+    '/sys/fs/cgroup/memory/memory.limit_in_bytes']
+
+# cgroup v2 "<quota> <period>" file.
+CPU_MAX_FILE = '/sys/fs/cgroup/cpu.max'
+# cgroup v1 quota and period files.
+CPU_QUOTA_FILE = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+CPU_PERIOD_FILE = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+
+# cgroup v1 reports "no limit" as a very large page aligned number rather
+# than "max".
+UNLIMITED_THRESHOLD = 2 ** 60
+
+
+def _read_file(container, path) -> Optional[str]:
+    """Return the stripped contents of `path` in `container` or None."""
+    # XXX The test harness raises FileNotFoundError rather than PathError
+    #     for missing files.
+    try:
+        return container.pull(path).read().strip()
+    except (PathError, FileNotFoundError, NotImplementedError):
+        return None
+
+
+def get_memory_limit(container) -> Optional[int]:
+    """Return the memory limit of `container` in bytes.
+
+    None is returned if the limit cannot be read or no limit is set.
+    """
+    for path in MEMORY_LIMIT_FILES:
+        contents = _read_file(container, path)
+        if contents is None:
+            continue
+        if contents == 'max':
+            return None
+        try:
+            limit = int(contents)
+        except ValueError:
+            logger.warning("Unable to parse memory limit %s from %s", contents, path)
+            return None
+        if limit >= UNLIMITED_THRESHOLD:
+            return None
+        return limit
+    return None
+
+
+def get_cpu_limit(container) -> Optional[float]:
+    """Return the number of CPUs `container` is allowed to use.
+
+    None is returned if the limit cannot be read or no quota is set.
+    """
+    contents = _read_file(container, CPU_MAX_FILE)
+    if contents is not None:
+        try:
+            quota, period = contents.split()
+        except ValueError:
+            logger.warning("Unable to parse cpu limit %s", contents)
+            return None
+    else:
+        quota = _read_file(container, CPU_QUOTA_FILE)
+        period = _read_file(container, CPU_PERIOD_FILE)
+        if quota is None or period is None:
+            return None
+    if quota in ('max', '-1'):
+        return None
+    try:
+        return int(quota) / int(period)
+    except (ValueError, ZeroDivisionError):
+        logger.warning("Unable to parse cpu limit %s/%s", quota, period)
+        return None
@@ -6,19 +6,33 @@
 
 """Charm for deploying squid-ingress-cache"""
 
+import hashlib
 import jinja2
 import json
 import logging
+import re
+import socket
+import time
+import uuid
+import yaml
 
 # from typing import Union
 
-from ops.charm import CharmBase
+from ops.charm import CharmBase, RelationBrokenEvent
 from ops.framework import StoredState
 from ops.main import main
-from ops.pebble import PathError
+from ops.pebble import ExecError, PathError
 # from ops.model import ActiveStatus, BlockedStatus, Relation
-from ops.model import ActiveStatus, BlockedStatus
+from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
 from squid_templates import SQUID_TEMPLATE
+import cache_simulator
+import cgroup
+import log_analysis
+import purge
+import refresh_patterns
+import squid_client
+import squid_metrics
+import warmup
 from charms.nginx_ingress_integrator.v0.ingress import (
     IngressRequires,
     IngressProxyProvides,
@@ -29,18 +43,134 @@ from charms.nginx_ingress_integrator.v0.ingress import (
 
 logger = logging.getLogger(__name__)
 
+# Compiled once per hook rather than on every render.
+SQUID_JINJA_TEMPLATE = jinja2.Environment(
+    loader=jinja2.BaseLoader()).from_string(SQUID_TEMPLATE)
+
 
 class SquidIngressCacheCharm(CharmBase):
     """Squid Ingreess proxy charm."""
 
     _stored = StoredState()
     on = IngressCharmEvents()
-    SQUID_CONFIG_OPTIONS = ['log_format']
+    SQUID_CONFIG_OPTIONS = [
+        'log_format',
+        'access_log_mode',
+        'access_log_buffer_size',
+        'access_log_sample_rate',
+        'access_log_misses_only',
+        'cache_mem',
+        'cache_dir_size',
+        'maximum_object_size',
+        'maximum_object_size_in_memory',
+        'peer_selection',
+        'peer_connect_fail_limit',
+        'peer_connect_timeout',
+        'collapsed_forwarding',
+        'max_stale',
+        'server_persistent_connections',
+        'client_persistent_connections',
+        'server_idle_pconn_timeout',
+        'client_idle_pconn_timeout',
+        'peer_standby',
+        'origin_tls',
+        'origin_tls_verify',
+        'origin_max_connections',
+        'origin_max_bytes_per_second',
+        'origin_limit_whitelist',
+        'store_id_strip_params',
+        'store_id_sort_query',
+        'cache_profile',
+        'memory_replacement_policy',
+        'cache_replacement_policy',
+        'range_offset_limit',
+        'cache_dir_min_size',
+        'dns_ipcache_size',
+        'dns_positive_ttl',
+        'dns_negative_ttl',
+        'dns_v4_first']
+    ACCESS_LOG_MODES = ['daemon', 'buffered', 'stdio', 'sampled', 'off']
+    # buffer-size used by the buffered access log mode if not set.
+    ACCESS_LOG_BUFFER_SIZE = '1 MB'
+    # cache_peer options accepted by peer_selection.
+    PEER_SELECTION_METHODS = [
+        'round-robin',
+        'weighted-round-robin',
+        'sourcehash',
+        'carp']
+    # How cache_peer lines address the website units.
+    PEER_ADDRESS_MODES = ['fqdn', 'ip']
+    # Defaults applied by cache_profile, any of which can be overridden
+    # by setting the option itself.
+    CACHE_PROFILES = {
+        # Many small hot objects: keep the most requested objects per byte
+        # in both stores and never fetch more than the requested range.
+        'small-objects': {
+            'memory_replacement_policy': 'heap GDSF',
+            'cache_replacement_policy': 'heap GDSF',
+            'maximum_object_size_in_memory': '256 KB',
+            'range_offset_limit': '0'},
+        # A few large media files: keep small objects in memory and large
+        # ones on disk, favouring frequently used bytes, and fetch whole
+        # objects for range requests so later ranges are hits.
+        'large-media': {
+            'memory_replacement_policy': 'heap GDSF',
+            'cache_replacement_policy': 'heap LFUDA',
+            'maximum_object_size_in_memory': '1 MB',
+            'maximum_object_size': '1 GB',
+            'cache_dir_min_size': 1024 * 1024,
+            'range_offset_limit': '-1'},
+    }
+    # Fraction of the container memory limit given to cache_mem when it is
+    # not set explicitly. Squid needs headroom on top of cache_mem for its
+    # index and in-transit objects.
+    CACHE_MEM_RATIO = 0.25
+    # Largest default cache_mem, in MB, with several workers. Their shared
+    # memory cache is kept in /dev/shm, which is 64 MB in a default pod and
+    # also holds squid's other shared segments.
+    SHARED_CACHE_MEM_LIMIT = 32
+    # Squid's default forward_max_tries.
+    SQUID_FORWARD_MAX_TRIES = 25
+    # Plain HTTP port, bound to localhost, used to reach the cache manager.
+    SQUID_MANAGER_PORT = 3130
+    # Seconds the charm's readiness probe waits for squid to answer, kept
+    # short so a slow squid does not hold up hooks.
+    SQUID_PROBE_TIMEOUT = 2
+    # Port the squid exporter serves Prometheus metrics on.
+    METRICS_PORT = 9301
+    SQUID_EXPORTER_FILE = "/usr/local/bin/squid_metrics.py"
+    SQUID_STORE_ID_FILE = "/usr/local/bin/squid_store_id.py"
+    # Ports used for cooperation between sibling squid units.
+    SIBLING_PORT = 3129
+    HTCP_PORT = 4827
+    SQUID_CONFIG_FILE = "/etc/squid/squid.conf"
+    SQUID_ACCESS_LOG = "/var/log/squid/access.log"
+    SQUID_CACHE_DIR = "/var/spool/squid"
+    # Records the cache_dir lines the cache storage was initialised for.
+    SQUID_CACHE_DIR_MARKER = "/var/spool/squid/.squid-ingress-cache-init"
+    SQUID_CANDIDATE_CONFIG_FILE = "/etc/squid/squid.conf.new"
+    # Directives which "squid -k reconfigure" cannot apply to a running
+    # squid. Changing any of these requires a full restart.
+    RESTART_DIRECTIVES = [
+        'workers',
+        'cache_dir',
+        'cache_mem',
+        'memory_cache_shared',
+        'memory_replacement_policy',
+        'cache_replacement_policy']
 
     def __init__(self, *args):
         super().__init__(*args)
         self._stored.set_default(
             squid_pebble_ready=False,
+            handled_purge_requests={},
+            # Access log matches per refresh pattern regex.
+            refresh_pattern_counts={},
+            exporter_defined=False,
+            # Hashes of what was last applied, used to skip unchanged work.
+            squid_config_hash=None,
+            pebble_layer_hash=None,
+            ingress_config_hash=None,
         )
         # The register event handlers
         self.ingress_proxy_provides = IngressProxyProvides(
@@ -56,17 +186,336 @@ class SquidIngressCacheCharm(CharmBase):
         self.framework.observe(
             self.on.ingress_available,
             self._ingress_proxy_available)
+        self.framework.observe(
+            self.on.config_changed,
+            self._configure_charm)
+        # Cache peers are rendered from the units of the website
+        # application so every unit must reconfigure as they come and go.
+        self.framework.observe(
+            self.on.ingress_proxy_relation_joined,
+            self._configure_charm)
+        # ingress_available is only emitted on the leader, unit addresses
+        # used by peer_address_mode=ip change on relation-changed.
+        self.framework.observe(
+            self.on.ingress_proxy_relation_changed,
+            self._configure_charm)
+        self.framework.observe(
+            self.on.ingress_proxy_relation_departed,
+            self._configure_charm)
+        self.framework.observe(
+            self.on.cluster_relation_joined,
+            self._configure_charm)
+        self.framework.observe(
+            self.on.cluster_relation_departed,
+            self._configure_charm)
+        self.framework.observe(
+            self.on.metrics_endpoint_relation_joined,
+            self._metrics_endpoint_relation_joined)
+        self.framework.observe(
+            self.on.metrics_endpoint_relation_broken,
+            self._configure_charm)
         self.framework.observe(
             self.on.update_status,
-            self._assess_charm_state)
+            self._update_status)
+        self.framework.observe(
+            self.on.warm_cache_action,
+            self._warm_cache_action)
+        self.framework.observe(
+            self.on.purge_action,
+            self._purge_action)
+        self.framework.observe(
+            self.on.analyse_access_log_action,
+            self._analyse_access_log_action)
+        self.framework.observe(
+            self.on.simulate_cache_action,
+            self._simulate_cache_action)
+        self.framework.observe(
+            self.on.optimise_refresh_patterns_action,
+            self._optimise_refresh_patterns_action)
+        self.framework.observe(
+            self.on.cluster_relation_changed,
+            self._cluster_relation_changed)
 
     def _squid_pebble_ready(self, event) -> None:
         self._stored.squid_pebble_ready = True
+        # The container may have been restarted and lost its config and
+        # plan so reapply everything.
+        self._stored.squid_config_hash = None
+        self._stored.pebble_layer_hash = None
         self._configure_charm(event)
 
     def _ingress_proxy_available(self, event) -> None:
         self._configure_charm(event)
 
+    def _warm_cache_action(self, event) -> None:
+        """Fetch the requested URLs through squid to fill the cache."""
+        if not self._get_ingress_config_from_relation():
+            event.fail('Ingress proxy relation missing or incomplete')
+            return
+        ingress_config = self._get_ingress_config()
+        port = ingress_config['service-port']
+        host = ingress_config['service-hostname']
+        timeout = event.params['timeout']
+        urls = event.params.get('urls', '').split()
+        start = time.monotonic()
+        if event.params.get('sitemap'):
+            try:
+                urls.extend(warmup.get_sitemap_urls(
+                    event.params['sitemap'], port, host, timeout))
+            except warmup.SitemapError as e:
+                event.fail(f"Unable to read sitemap {e}")
+                return
+        if not urls:
+            event.fail('No URLs given, set urls or sitemap')
+            return
+        results = warmup.warm(
+            urls, port, host, event.params['concurrency'], timeout)
+        summary = {}
+        for result in results:
+            key = result['result'] if 'error' not in result else 'error'
+            summary[key] = summary.get(key, 0) + 1
+        event.set_results({
+            'urls': len(results),
+            'bytes': sum(r['bytes'] for r in results),
+            'total-time': round(time.monotonic() - start, 3),
+            'summary': json.dumps(summary),
+            'results': json.dumps(results)})
+
+    def _purge_action(self, event) -> None:
+        """Remove matching objects from the cache."""
+        if not self._get_ingress_config_from_relation():
+            event.fail('Ingress proxy relation missing or incomplete')
+            return
+        purge_request = {
+            'urls': event.params.get('urls', '').split(),
+            'prefixes': event.params.get('prefixes', '').split(),
+            'regexes': event.params.get('regexes', '').split()}
+        if not any(purge_request.values()):
+            event.fail('Nothing to purge, set urls, prefixes or regexes')
+            return
+        counts = {}
+        try:
+            results = self._purge(purge_request, counts)
+        except re.error as e:
+            event.fail(f"Invalid regex: {e}")
+            return
+        except OSError as e:
+            event.fail(f"Unable to list cached objects: {e}")
+            return
+        if event.params.get('all-units'):
+            self._request_cluster_purge(purge_request)
+        summary = {}
+        for result in results:
+            summary[str(result['status'])] = summary.get(
+                str(result['status']), 0) + 1
+        event.set_results({
+            'purged': summary.get('200', 0),
+            'summary': json.dumps(summary),
+            'results': json.dumps(results),
+            'unlisted-objects': counts.get('unlisted', 0),
+            'urls-from-access-log': counts.get('logged', 0)})
+
+    def _purge(self, purge_request, counts=None) -> list:
+        """Purge the URLs and any cached URLs matching the patterns.
+
+        Objects only on disk have no URL in squid's object list, so URLs
+        matching the patterns are also taken from the access log. Objects
+        whose URL is in neither are missed. `counts` is filled with the
+        number of such unlisted objects and of URLs from the log.
+        """
+        counts = {} if counts is None else counts
+        ingress_config = self._get_ingress_config()
+        urls = list(purge_request['urls'])
+        if purge_request['prefixes'] or purge_request['regexes']:
+            urls.extend(purge.select_urls(
+                purge.list_cached_urls(self.SQUID_MANAGER_PORT, counts=counts),
+                purge_request['prefixes'],
+                purge_request['regexes']))
+            if counts.get('unlisted'):
+                logged = self._select_logged_urls(purge_request)
+                counts['logged'] = len(set(logged) - set(urls))
+                urls.extend(logged)
+        return purge.purge(
+            list(dict.fromkeys(urls)),
+            ingress_config['service-port'],
+            ingress_config['service-hostname'])
+
+    def _select_logged_urls(self, purge_request) -> list:
+        """Return the URLs in the access log matching the purge patterns."""
+        logged = []
+
+        def select(lines):
+            logged.extend(purge.select_urls(
+                purge.logged_urls(lines, self.config['log_format']),
+                purge_request['prefixes'],
+                purge_request['regexes']))
+
+        try:
+            self._stream_log(self.SQUID_ACCESS_LOG, select)
+        except (ExecError, ValueError, re.error) as e:
+            logger.warning("Unable to read URLs from the access log: %s", e)
+            return []
+        return logged
+
+    def _request_cluster_purge(self, purge_request) -> None:
+        """Ask the other squid units to run the same purge.
+
+        The request is published in this unit's cluster relation data and
+        picked up by the other units in their relation-changed hook.
+        """
+        relation = self.model.get_relation('cluster')
+        if not relation:
+            return
+        purge_request = dict(purge_request, id=str(uuid.uuid4()))
+        relation.data[self.unit]['purge-request'] = json.dumps(purge_request)
+
+    def _cluster_relation_changed(self, event) -> None:
+        """Pick up sibling addresses and run purges requested by siblings."""
+        self._configure_charm(event)
+        if not event.unit:
+            return
+        try:
+            purge_request = json.loads(
+                event.relation.data[event.unit]['purge-request'])
+        except KeyError:
+            return
+        handled = self._stored.handled_purge_requests
+        if handled.get(event.unit.name) == purge_request['id']:
+            return
+        if not self._assess_charm_state(event):
+            return
+        logger.info("Running purge requested by %s", event.unit.name)
+        try:
+            self._purge(purge_request)
+        except (re.error, OSError) as e:
+            logger.error("Purge requested by %s failed: %s", event.unit.name, e)
+        handled[event.unit.name] = purge_request['id']
+
+    def _analyse_access_log_action(self, event) -> None:
+        """Report cache effectiveness from the squid access log."""
+        try:
+            analyser = log_analysis.AccessLogAnalyser(self.config['log_format'])
+        except ValueError as e:
+            event.fail(f"Unable to analyse log_format: {e}")
+            return
+        if not self._stream_access_log(event, analyser.add_lines):
+            return
+        self._set_report_results(event, analyser.report(
+            top=event.params['top'],
+            min_requests=event.params['min-requests']))
+
+    def _stream_access_log(self, event, consume) -> bool:
+        """Pass the lines of the action's log-file to `consume`.
+
+        The log is streamed through cat rather than pulled, logs can be
+        many gigabytes. Fails `event` and returns False if it can't be read.
+        """
+        log_file = event.params.get('log-file') or self.SQUID_ACCESS_LOG
+        try:
+            self._stream_log(log_file, consume)
+        except ExecError as e:
+            event.fail(f"Unable to read {log_file}, exit code {e.exit_code}")
+            return False
+        return True
+
+    def _stream_log(self, log_file, consume) -> None:
+        """Pass the lines of `log_file` in the squid container to `consume`.
+
+        Raises ExecError if the log can't be read.
+        """
+        container = self.unit.get_container("squid")
+        process = container.exec(['cat', log_file], encoding='utf-8')
+        consume(process.stdout)
+        process.wait()
+
+    @staticmethod
+    def _set_report_results(event, report) -> None:
+        """Set an action's results, JSON encoding nested values."""
+        event.set_results({
+            k: json.dumps(v) if isinstance(v, (dict, list)) else v
+            for k, v in report.items()})
+
+    def _simulate_cache_action(self, event) -> None:
+        """Report the hit ratios other cache sizes and policies would give."""
+        max_object_size = event.params.get('max-object-size') \
+            or self.config.get('maximum_object_size') or '4 MB'
+        try:
+            simulator = cache_simulator.Simulator(
+                self.config['log_format'],
+                [s.strip() for s in event.params['sizes'].split(',') if s.strip()],
+                [p.strip() for p in event.params['policies'].split(',') if p.strip()],
+                cache_simulator.parse_size(max_object_size))
+        except ValueError as e:
+            event.fail(f"Invalid parameters: {e}")
+            return
+        if not self._stream_access_log(event, simulator.add_lines):
+            return
+        self._set_report_results(event, simulator.report())
+
+    def _optimise_refresh_patterns_action(self, event) -> None:
+        """Report how the refresh patterns were cleaned up and ordered.
+
+        With count set the patterns matching each URL in the access log
+        are counted first and the counts used to order the patterns.
+        """
+        ctxt = {
+            k.replace('-', '_'): v
+            for k, v in self._get_squid_config_from_relation().items()}
+        patterns, report = self._get_refresh_patterns(ctxt)
+        if event.params.get('count'):
+            try:
+                regex = log_analysis.logformat_regex(self.config['log_format'])
+            except re.error as e:
+                event.fail(f"Unable to parse log_format: {e}")
+                return
+            if 'url' not in regex.groupindex:
+                event.fail('log_format must include %ru')
+                return
+            counts = {}
+
+            def count_matches(lines):
+                matches = (regex.match(line.rstrip('\n')) for line in lines)
+                urls = (match.group('url') for match in matches if match)
+                counts.update(refresh_patterns.count_matches(patterns, urls))
+
+            if not self._stream_access_log(event, count_matches):
+                return
+            self._stored.refresh_pattern_counts = counts
+            patterns, report = self._get_refresh_patterns(ctxt)
+            report['counts'] = counts
+            self._configure_charm(event)
+        report['refresh-patterns'] = [p['regex'] for p in patterns]
+        self._set_report_results(event, report)
+
+    def _metrics_endpoint_relation_joined(self, event) -> None:
+        """Publish the scrape job for the squid exporter.
+
+        The data follows the prometheus_scrape interface, the "*" target
+        is expanded by Prometheus to the address of each unit.
+        """
+        relation = event.relation
+        relation.data[self.unit]['prometheus_scrape_unit_address'] = \
+            self._get_unit_address()
+        relation.data[self.unit]['prometheus_scrape_unit_name'] = \
+            self.unit.name
+        if self.unit.is_leader():
+            relation.data[self.app]['scrape_metadata'] = json.dumps({
+                'model': self.model.name,
+                'model_uuid': self.model.uuid,
+                'application': self.app.name,
+                'unit': self.unit.name,
+                'charm_name': self.meta.name})
+            relation.data[self.app]['scrape_jobs'] = json.dumps([{
+                'metrics_path': '/metrics',
+                'static_configs': [
+                    {'targets': [f'*:{self.METRICS_PORT}']}]}])
+        self._configure_charm(event)
+
+    def _get_unit_address(self, domain="svc.cluster.local") -> str:
+        """Return the cluster DNS name of this unit."""
+        unit_name = self.unit.name.replace('/', '-')
+        return f"{unit_name}.{self.app.name}-endpoints.{self.model.name}.{domain}"
+
     def _assess_charm_state(self, event):
         """Check if charm is ready to enable service.
 
@@ -86,59 +535,441 @@ class SquidIngressCacheCharm(CharmBase):
         return True
 
     def _configure_charm(self, event) -> None:
-        """Configure service if minimum requirements are met."""
+        """Configure service if minimum requirements are met.
+
+        Each step is skipped if its output has the same hash as the last
+        time it was applied.
+        """
         if self._assess_charm_state(event):
-            squid_config = self._get_squid_config()
+            ingress_config = self._get_ingress_config()
+            squid_config = self._get_squid_config(ingress_config)
+            squid_config_hash = self._hash(squid_config)
+            if squid_config_hash != self._stored.squid_config_hash:
+                if self.SQUID_STORE_ID_FILE in squid_config:
+                    self._push_script('store_id.py', self.SQUID_STORE_ID_FILE)
+                if not self._render_config(squid_config):
+                    self.unit.status = BlockedStatus(
+                        'Generated squid.conf is invalid, see juju debug-log')
+                    return
+                self._stored.squid_config_hash = squid_config_hash
             self._configure_pebble(event)
-            self._render_config(squid_config)
-            self.ingress.update_config(self._get_ingress_config())
+            self._update_ingress(ingress_config)
+            # Traffic is gated by the squid-ready Pebble check, which keeps
+            # the pod out of the service endpoints until squid listens. This
+            # probe only decides the unit's status.
+            if not self._squid_ready(ingress_config['service-port']):
+                self.unit.status = WaitingStatus('Waiting for squid to start')
+
+    def _update_status(self, event) -> None:
+        """Retry anything waiting on squid and summarise its traffic."""
+        self._configure_charm(event)
+        if isinstance(self.unit.status, ActiveStatus):
+            self.unit.status = ActiveStatus(self._get_status_summary())
 
-    def _get_squid_config(self) -> str:
+    def _squid_ready(self, port) -> bool:
+        """Whether squid accepts connections on `port` and its cache manager.
+
+        Squid is probed once without waiting for it to finish starting,
+        update-status checks again later.
+        """
+        if not self._squid_running():
+            return False
+        try:
+            socket.create_connection(
+                ('127.0.0.1', port), timeout=self.SQUID_PROBE_TIMEOUT).close()
+            self._read_manager_page('info', timeout=self.SQUID_PROBE_TIMEOUT)
+        except OSError as e:
+            logger.info("Squid is not ready: %s", e)
+            return False
+        return True
+
+    def _read_manager_page(self, page, timeout=10) -> list:
+        """Return the lines of a cache manager page."""
+        with squid_client.open_manager_page(
+                page, self.SQUID_MANAGER_PORT, timeout=timeout) as response:
+            return response.read().decode('utf-8', 'replace').splitlines()
+
+    def _get_status_summary(self) -> str:
+        """Return squid's request rate and hit ratio over the last 5 minutes."""
+        try:
+            info = squid_metrics.parse_info(self._read_manager_page('info'))
+            five_min = squid_metrics.parse_key_values(
+                self._read_manager_page('5min'))
+        except OSError as e:
+            logger.warning("Unable to read squid statistics: %s", e)
+            return ''
+        summary = []
+        if 'client_http.requests' in five_min:
+            summary.append(f"{five_min['client_http.requests']:.1f} req/s")
+        if 'squid_hit_ratio' in info:
+            summary.append(f"{info['squid_hit_ratio']:.0%} hit ratio")
+        return ', '.join(summary)
+
+    @staticmethod
+    def _hash(data) -> str:
+        """Return a stable hash of a string or JSON serialisable `data`."""
+        if not isinstance(data, str):
+            data = json.dumps(data, sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _update_ingress(self, ingress_config) -> None:
+        """Publish `ingress_config` on the ingress relation if changed.
+
+        Rewriting unchanged relation data still wakes up the remote side.
+        """
+        relation = self.model.get_relation('ingress')
+        ingress_config_hash = self._hash({
+            'relation': relation.id if relation else None,
+            'leader': self.unit.is_leader(),
+            'config': ingress_config})
+        if ingress_config_hash == self._stored.ingress_config_hash:
+            return
+        self.ingress.update_config(ingress_config)
+        self._stored.ingress_config_hash = ingress_config_hash
+
+    def _get_squid_config(self, ingress_config=None) -> str:
         """Generate squid.conf contents."""
-        jinja_env = jinja2.Environment(loader=jinja2.BaseLoader())
-        jinja_template = jinja_env.from_string(SQUID_TEMPLATE)
-        ingress_config = self._get_ingress_config()
+        if ingress_config is None:
+            ingress_config = self._get_ingress_config()
         squid_config = self._get_squid_config_from_relation()
+        websites = self._get_website_routes()
         ctxt = {
-            'port': ingress_config['service-port'],
-            'peers': self._get_cache_peers()}
+            'websites': websites,
+            'ports': sorted({w['port'] for w in websites}, key=str),
+            'routing': len(websites) > 1,
+            # Requests no website unit can take are failed rather than
+            # forwarded directly to the external hostname.
+            'never_direct': len(websites) > 1 or bool(
+                self.config.get('origin_max_connections')),
+            'origin_limit_exempt': self._get_origin_limit_whitelist(websites),
+            'peers': [p for w in websites for p in w['peers']],
+            'siblings': self._get_siblings(),
+            'sibling_addresses': self._get_sibling_addresses(),
+            'sibling_port': self.SIBLING_PORT,
+            'sibling_protocol': self.config.get('sibling_protocol'),
+            'htcp_port': self.HTCP_PORT,
+            'manager_port': self.SQUID_MANAGER_PORT}
         for k in self.SQUID_CONFIG_OPTIONS:
-            ctxt[k] = self.config[k]
+            ctxt[k] = self.config.get(k)
         ctxt.update(squid_config)
         ctxt = {k.replace('-', '_'): v for k, v in ctxt.items()}
-        return jinja_template.render(**ctxt)
+        self._apply_cache_profile(ctxt)
+        ctxt['refresh_patterns'] = self._get_refresh_patterns(ctxt)[0]
+        if not ctxt.get('cache_mem'):
+            ctxt['cache_mem'] = self._get_default_cache_mem()
+        if not ctxt.get('cache_dir_size') and self.model.storages['cache']:
+            logger.warning(
+                "Cache storage is attached but cache_dir_size is not set, "
+                "objects are only cached in memory")
+        ctxt['workers'] = self._get_workers()
+        ctxt['peer_options'] = self._get_cache_peer_options(ctxt)
+        ctxt['store_id_program'] = self._get_store_id_program(ctxt)
+        ctxt.update(self._get_access_log(ctxt))
+        ctxt['retry_on_error'] = self._get_retry_on_error(
+            ingress_config.get('retry-errors'))
+        if ingress_config.get('retry-errors'):
+            # Like nginx's proxy_next_upstream try each origin unit once,
+            # squid's default already covers all but the largest websites.
+            peers = max([len(w['peers']) for w in websites] + [1])
+            if peers > self.SQUID_FORWARD_MAX_TRIES:
+                ctxt['forward_max_tries'] = peers
+        return SQUID_JINJA_TEMPLATE.render(**ctxt)
+
+    def _get_refresh_patterns(self, ctxt) -> tuple:
+        """Return the optimised refresh patterns and what was changed."""
+        patterns, report = refresh_patterns.optimise(
+            ctxt.get('refresh_patterns'),
+            dict(self._stored.refresh_pattern_counts))
+        for invalid in report['invalid']:
+            logger.warning(
+                "Ignoring refresh pattern %s: %s",
+                invalid['regex'], invalid['error'])
+        return patterns, report
+
+    def _apply_cache_profile(self, ctxt) -> None:
+        """Fill options left unset from the selected cache_profile."""
+        profile = ctxt.get('cache_profile')
+        if not profile:
+            return
+        if profile not in self.CACHE_PROFILES:
+            logger.error(
+                "Ignoring unknown cache profile %s, valid profiles are %s",
+                profile, ", ".join(self.CACHE_PROFILES))
+            return
+        for k, v in self.CACHE_PROFILES[profile].items():
+            if not ctxt.get(k):
+                ctxt[k] = v
+
+    def _get_cache_peer_options(self, ctxt) -> list:
+        """Return the balancing and failure detection cache_peer options."""
+        options = []
+        peer_selection = ctxt.get('peer_selection')
+        if peer_selection in self.PEER_SELECTION_METHODS:
+            options.append(peer_selection)
+        elif peer_selection:
+            logger.error(
+                "Ignoring unknown peer selection method %s, valid "
+                "methods are %s", peer_selection,
+                ", ".join(self.PEER_SELECTION_METHODS))
+        if ctxt.get('peer_connect_fail_limit'):
+            options.append(
+                f"connect-fail-limit={ctxt['peer_connect_fail_limit']}")
+        if ctxt.get('peer_connect_timeout'):
+            options.append(f"connect-timeout={ctxt['peer_connect_timeout']}")
+        if ctxt.get('peer_standby'):
+            options.append(f"standby={ctxt['peer_standby']}")
+        if ctxt.get('origin_tls'):
+            options.append('tls')
+            if ctxt.get('origin_tls_verify') is False:
+                options.append('tls-flags=DONT_VERIFY_PEER')
+        return options
+
+    def _get_access_log(self, ctxt) -> dict:
+        """Return where and which requests the access log is written.
+
+        'daemon' hands log lines to squid's log daemon, 'buffered' does the
+        same with a larger buffer and drops lines rather than blocking if
+        the daemon falls behind, 'stdio' writes to squid's stdout which
+        Pebble collects, 'sampled' only logs 1 in access_log_sample_rate
+        requests and 'off' writes no access log. access_log_misses_only
+        only logs requests forwarded to a website or sibling.
+        """
+        mode = ctxt.get('access_log_mode') or 'daemon'
+        if mode not in self.ACCESS_LOG_MODES:
+            logger.error(
+                "Ignoring unknown access log mode %s, valid modes are %s",
+                mode, ", ".join(self.ACCESS_LOG_MODES))
+            mode = 'daemon'
+        access_log = {
+            'access_log_mode': mode,
+            'access_log_destination': f'daemon:{self.SQUID_ACCESS_LOG}',
+            'access_log_options': [],
+            'access_log_sample': None,
+            'access_log_acls': []}
+        if mode == 'stdio':
+            access_log['access_log_destination'] = 'stdio:/dev/stdout'
+        buffer_size = ctxt.get('access_log_buffer_size')
+        if mode == 'buffered':
+            buffer_size = buffer_size or self.ACCESS_LOG_BUFFER_SIZE
+            access_log['access_log_options'].append('on-error=drop')
+        if buffer_size:
+            access_log['access_log_options'].append(
+                f"buffer-size={buffer_size.replace(' ', '')}")
+        sample_rate = ctxt.get('access_log_sample_rate') or 1
+        if mode == 'sampled' and sample_rate > 1:
+            access_log['access_log_sample'] = f'1/{sample_rate}'
+            access_log['access_log_acls'].append('access_log_sample')
+        if ctxt.get('access_log_misses_only'):
+            access_log['access_log_acls'].append('!access_log_hit')
+        return access_log
+
+    def _get_store_id_program(self, ctxt) -> str:
+        """Return the store_id_program normalising cache keys, if any.
+
+        store_id_strip_params is a list, or a string of names separated by
+        spaces or commas.
+        """
+        strip_params = ctxt.get('store_id_strip_params') or []
+        if isinstance(strip_params, str):
+            strip_params = strip_params.replace(',', ' ').split()
+        if not strip_params and not ctxt.get('store_id_sort_query'):
+            return None
+        command = ['/usr/bin/python3', self.SQUID_STORE_ID_FILE]
+        if strip_params:
+            command.append('--strip-params')
+            command.extend(strip_params)
+        if ctxt.get('store_id_sort_query'):
+            command.append('--sort-query')
+        return ' '.join(command)
+
+    def _get_retry_on_error(self, retry_errors) -> bool:
+        """Whether the ingress retry-errors ask for retries on HTTP errors.
+
+        retry-errors uses the nginx proxy_next_upstream syntax, eg
+        "error,timeout,http_502,http_503". Squid always retries connection
+        errors and timeouts, retrying on HTTP errors has to be enabled.
+        """
+        if not retry_errors:
+            return False
+        return any(
+            e.strip().startswith('http_')
+            for e in str(retry_errors).split(','))
+
+    def _get_workers(self) -> int:
+        """Return the number of squid worker processes to run.
+
+        If the workers option is 0 one worker is run per CPU allowed by the
+        squid container's cgroup quota.
+        """
+        workers = self.config.get('workers')
+        if workers:
+            return workers
+        container = self.unit.get_container("squid")
+        cpu_limit = cgroup.get_cpu_limit(container)
+        if not cpu_limit:
+            return 1
+        return max(1, int(cpu_limit))
+
+    def _get_squid_command(self) -> str:
+        """Return the command used to run squid in the foreground.
+
+        -N disables SMP so is only used when running a single worker.
+        """
+        if self._get_workers() > 1:
+            return "/usr/sbin/squid --foreground"
+        return "/usr/sbin/squid -N"
+
+    def _get_default_cache_mem(self) -> str:
+        """Size cache_mem from the squid container memory limit.
+
+        Returns None if the container has no memory limit, in which case
+        squid's own default is used. With several workers the memory cache
+        is shared through /dev/shm so it is capped to fit there.
+        """
+        container = self.unit.get_container("squid")
+        limit = cgroup.get_memory_limit(container)
+        if not limit:
+            return None
+        cache_mem = int(limit * self.CACHE_MEM_RATIO) // (1024 * 1024)
+        if self._get_workers() > 1:
+            cache_mem = min(cache_mem, self.SHARED_CACHE_MEM_LIMIT)
+        if cache_mem < 1:
+            return None
+        return f"{cache_mem} MB"
 
     def _restart_squid(self):
         container = self.unit.get_container("squid")
         logger.info("Restarting squid")
         if container.get_service("squid").is_running():
             container.stop("squid")
+        self._initialise_cache_dir()
         container.start("squid")
 
-    def _render_config(self, squid_config) -> None:
-        """Push squid.conf to payload container."""
-        logger.info("Pushing new squid.conf")
-        logger.info(squid_config)
+    def _squid_command_changed(self) -> bool:
+        """Whether the squid service's command differs from the one needed.
+
+        Switching between one and several workers changes the command, so
+        the Pebble layer must be replaced before squid is restarted.
+        """
+        container = self.unit.get_container("squid")
+        service = container.get_plan().services.get("squid")
+        return bool(service) and service.command != self._get_squid_command()
+
+    def _squid_running(self) -> bool:
+        """Whether the squid service is defined and running."""
+        container = self.unit.get_container("squid")
+        service = container.get_services("squid").get("squid")
+        return bool(service and service.is_running())
+
+    def _initialise_cache_dir(self) -> None:
+        """Create the on-disk cache structures with "squid -z".
+
+        The cache storage persists across pod restarts so this only runs
+        when the cache_dir lines differ from those the storage was last
+        initialised for. Squid must not be running.
+        """
         container = self.unit.get_container("squid")
         try:
-            existing_config = container.pull("/etc/squid/squid.conf").read()
-        except (PathError, NotImplementedError):
-            existing_config = ''
-        # XXX This try/except is to handle the fact that push is not
-        #     implemented in the test hareess yet.
+            squid_config = container.pull(self.SQUID_CONFIG_FILE).read()
+        except (PathError, FileNotFoundError):
+            return
+        cache_dirs = '\n'.join(
+            line for line in squid_config.splitlines()
+            if line.startswith('cache_dir '))
+        if not cache_dirs:
+            return
+        try:
+            initialised = container.pull(self.SQUID_CACHE_DIR_MARKER).read()
+        except (PathError, FileNotFoundError):
+            initialised = ''
+        if initialised == cache_dirs:
+            return
+        logger.info("Initialising squid cache directory")
+        # Storage is mounted owned by root but squid drops privileges
+        # before creating its swap directories.
+        if not self._run_command(
+                ["chown", "proxy:proxy", self.SQUID_CACHE_DIR]):
+            return
+        if not self._run_squid_command(
+                "-z", "-N", "-f", self.SQUID_CONFIG_FILE):
+            return
+        container.push(self.SQUID_CACHE_DIR_MARKER, cache_dirs, make_dirs=True)
+
+    def _run_squid_command(self, *args) -> bool:
+        """Run the squid binary in the payload container with `args`."""
+        return self._run_command(["/usr/sbin/squid"] + list(args))
+
+    def _run_command(self, command) -> bool:
+        """Run `command` in the payload container."""
+        container = self.unit.get_container("squid")
+        logger.info("Running %s", " ".join(command))
+        try:
+            container.exec(command).wait_output()
+        except ExecError as e:
+            logger.error(
+                "%s failed with exit code %d: %s",
+                " ".join(command), e.exit_code, e.stderr)
+            return False
+        return True
+
+    def _reconfigure_squid(self):
+        """Apply squid.conf to the running squid without a restart."""
+        logger.info("Reconfiguring squid")
+        self._run_squid_command("-k", "reconfigure")
+
+    def _restart_required(self, existing_config, squid_config) -> bool:
+        """Whether the config change cannot be applied by a reconfigure."""
+        def _restart_directives(config):
+            return [line for line in config.splitlines()
+                    if line.split(' ', 1)[0] in self.RESTART_DIRECTIVES]
+        existing_directives = _restart_directives(existing_config)
+        return existing_directives != _restart_directives(squid_config)
+
+    def _render_config(self, squid_config) -> bool:
+        """Push squid.conf to payload container.
+
+        The new config is validated with "squid -k parse" before it
+        replaces the existing one and is then applied with a reconfigure,
+        which keeps the in-memory cache and open connections. Squid is only
+        restarted if a directive which cannot be reloaded has changed.
+
+        Returns False if the new config failed validation.
+        """
+        container = self.unit.get_container("squid")
         try:
-            container.push("/etc/squid/squid.conf", squid_config)
-        except NotImplementedError:
-            logger.error("Could not push /etc/squid/squid.conf to container")
-        if existing_config != squid_config:
-            logger.info("Config change detected, restarting squid")
+            existing_config = container.pull(self.SQUID_CONFIG_FILE).read()
+        except (PathError, FileNotFoundError, NotImplementedError):
+            existing_config = ''
+        if existing_config == squid_config:
+            return True
+        logger.info("Pushing new squid.conf")
+        logger.info(squid_config)
+        container.push(
+            self.SQUID_CANDIDATE_CONFIG_FILE,
+            squid_config,
+            make_dirs=True)
+        if not self._run_squid_command(
+                "-k", "parse", "-f", self.SQUID_CANDIDATE_CONFIG_FILE):
+            logger.error("New squid.conf failed validation, not applying it")
+            return False
+        container.push(self.SQUID_CONFIG_FILE, squid_config, make_dirs=True)
+        if not self._squid_running():
+            return True
+        if self._squid_command_changed():
+            # _configure_pebble restarts squid under its new command.
+            logger.info("Squid's command has changed, deferring its restart")
+        elif self._restart_required(existing_config, squid_config):
+            logger.info("Config change requires a restart of squid")
             self._restart_squid()
+        else:
+            logger.info("Config change detected, reconfiguring squid")
+            self._reconfigure_squid()
+        return True
 
     def _configure_pebble(self, event) -> None:
         """Define and start squid using the Pebble API. """
         # Get a reference the container attribute on the PebbleReadyEvent
         container = self.unit.get_container("squid")
-        existing_plan = container.get_plan().to_dict()
         # Define an initial Pebble layer configuration
         pebble_layer = {
             "summary": "squid layer",
@@ -147,27 +978,121 @@ class SquidIngressCacheCharm(CharmBase):
                 "squid": {
                     "override": "replace",
                     "summary": "squid service",
-                    "command": "/usr/sbin/squid -N",
+                    "command": self._get_squid_command(),
                     "startup": "enabled",
+                    "on-check-failure": {"squid-alive": "restart"},
                 }
             },
+            # Squid is ready once it accepts requests and its cache manager
+            # answers, and is restarted if the cache manager stops answering.
+            # Juju maps the ready level to the pod's readiness probe, which
+            # keeps a unit that is not ready out of the service endpoints.
+            "checks": {
+                "squid-ready": {
+                    "override": "replace",
+                    "level": "ready",
+                    "period": "10s",
+                    "threshold": 1,
+                    "tcp": {"port": self._get_ingress_config()['service-port']},
+                },
+                "squid-manager-ready": {
+                    "override": "replace",
+                    "level": "ready",
+                    "period": "10s",
+                    "threshold": 1,
+                    "http": {
+                        "url": (
+                            f"http://127.0.0.1:{self.SQUID_MANAGER_PORT}"
+                            "/squid-internal-mgr/info")},
+                },
+                "squid-alive": {
+                    "override": "replace",
+                    "level": "alive",
+                    "period": "30s",
+                    "threshold": 3,
+                    "http": {
+                        "url": (
+                            f"http://127.0.0.1:{self.SQUID_MANAGER_PORT}"
+                            "/squid-internal-mgr/info")},
+                },
+            },
         }
-        if existing_plan.get('services') != pebble_layer['services']:
-            # Add intial Pebble config layer using the Pebble API
-            container.add_layer("squid", pebble_layer, combine=True)
+        exporter_service = self._get_exporter_service(event)
+        if exporter_service:
+            pebble_layer['services']['squid-exporter'] = exporter_service
+        pebble_layer_hash = self._hash(pebble_layer)
+        if pebble_layer_hash == self._stored.pebble_layer_hash:
+            return
+        existing_plan = container.get_plan().to_dict()
+        if existing_plan.get('services') != pebble_layer['services'] or \
+                existing_plan.get('checks') != pebble_layer['checks']:
+            restart = self._squid_command_changed() and self._squid_running()
+            if exporter_service and exporter_service['startup'] == 'enabled':
+                self._push_script('squid_metrics.py', self.SQUID_EXPORTER_FILE)
+            # Add intial Pebble config layer using the Pebble API, as YAML
+            # because ops' Layer drops the checks. Pebble rejects layers with
+            # checks before health check support, hence the minimum Juju
+            # version in metadata.yaml.
+            container.add_layer("squid", yaml.safe_dump(pebble_layer), combine=True)
+            if exporter_service and exporter_service['startup'] == 'disabled':
+                exporter = container.get_services('squid-exporter')
+                if exporter and exporter['squid-exporter'].is_running():
+                    container.stop('squid-exporter')
+            if restart:
+                # autostart leaves a running squid on its old command.
+                self._restart_squid()
+            elif not self._squid_running():
+                self._initialise_cache_dir()
             # Autostart any services that were defined with startup: enabled
             container.autostart()
+        self._stored.pebble_layer_hash = pebble_layer_hash
+
+    def _get_exporter_service(self, event) -> dict:
+        """Return the Pebble service for the squid exporter.
 
-    def _get_data_from_relation(self, relation_name, required_keys, optional_keys=None) -> dict:
-        """Return subset of relation data from existing relation.
+        The exporter only runs while the metrics-endpoint relation exists.
+        Pebble services cannot be removed, so once it has been defined it is
+        disabled rather than dropped when the relation goes away.
+        """
+        relation = self.model.get_relation('metrics-endpoint')
+        if isinstance(event, RelationBrokenEvent) and event.relation == relation:
+            relation = None
+        if relation:
+            startup = "enabled"
+            self._stored.exporter_defined = True
+        elif self._stored.exporter_defined:
+            startup = "disabled"
+        else:
+            return None
+        return {
+            "override": "replace",
+            "summary": "squid prometheus exporter",
+            "command": (
+                f"python3 {self.SQUID_EXPORTER_FILE} "
+                f"--port {self.METRICS_PORT} "
+                f"--manager-port {self.SQUID_MANAGER_PORT}"),
+            "startup": startup,
+        }
 
-        If a relation with `relation_name` exists and all the keys specified
-        in `required_keys` are present on the relation then return a subset of
+    def _push_script(self, name, path) -> None:
+        """Copy the script `name` from src into the payload container."""
+        container = self.unit.get_container("squid")
+        source = self.charm_dir / 'src' / name
+        container.push(
+            path,
+            source.read_text(),
+            make_dirs=True,
+            permissions=0o755)
+
+    def _get_data_from_relation(self, relation, required_keys, optional_keys=None) -> dict:
+        """Return subset of relation data from `relation`.
+
+        If `relation` is not None and all the keys specified in
+        `required_keys` are present on the relation then return a subset of
         the relation data corresponding to `required_keys`.
         """
         data = {}
         optional_keys = optional_keys or []
-        relation = self.model.get_relation(relation_name)
         if relation:
             data = {k: relation.data[relation.app].get(k)
                     for k in list(required_keys) + list(optional_keys)
@@ -178,6 +1103,12 @@ class SquidIngressCacheCharm(CharmBase):
             return {}
 
     def _get_ingress_config(self) -> dict:
+        """Return the config published on the ingress relation.
+
+        The relation carries a single service-hostname, that of the
+        primary website. Other websites' hostnames are routed by squid but
+        have to be sent to squid's service some other way.
+        """
         default_config = {
             "service-hostname": self.app.name,
             "service-port": 3128,
@@ -185,33 +1116,165 @@ class SquidIngressCacheCharm(CharmBase):
         config = self._get_ingress_config_from_relation() or default_config
         config['service-name'] = self.app.name
         config.pop('cache-settings', None)
+        if self.config.get('ingress_hash_by'):
+            # Send each URL to the same squid unit so every unit caches a
+            # different part of the site and capacity grows with units.
+            config['upstream-hash-by'] = self.config['ingress_hash_by']
         return config
 
-    def _get_cache_peers(self, domain="svc.cluster.local") -> list:
-        relation = self.model.get_relation('ingress-proxy')
+    def _get_websites(self) -> list:
+        """Return the ingress-proxy relations of the websites to cache.
+
+        Relations with incomplete data or without units are skipped. They
+        are ordered by relation id, the first is the primary website which
+        is published on the ingress relation and used by the actions.
+        """
+        return [
+            relation for relation in sorted(
+                self.model.relations['ingress-proxy'], key=lambda r: r.id)
+            if relation.units and self._get_website_config(relation)]
+
+    def _get_website_config(self, relation) -> dict:
+        return self._get_data_from_relation(
+            relation,
+            REQUIRED_INGRESS_RELATION_FIELDS,
+            OPTIONAL_INGRESS_RELATION_FIELDS)
+
+    def _get_website_routes(self) -> list:
+        """Return each website's origin servers and the requests for it.
+
+        Requests are routed on the website's service-hostname and, if set,
+        the comma separated path prefixes in its path-routes. A website
+        without path-routes does not get the paths routed to another
+        website with the same hostname.
+        """
+        websites = []
+        for relation in self._get_websites():
+            config = self._get_website_config(relation)
+            paths = [
+                p.strip() for p in str(config.get('path-routes', '')).split(',')
+                if p.strip()]
+            websites.append({
+                'name': relation.app.name,
+                'hostname': config['service-hostname'],
+                'port': config['service-port'],
+                'peers': self._get_cache_peers(relation=relation),
+                'paths': [f"^{re.escape(p)}" for p in paths],
+                'limit_whitelist': config.get('limit-whitelist')})
+        for website in websites:
+            if website['paths']:
+                website['excluded'] = []
+                continue
+            website['excluded'] = [
+                other['name'] for other in websites
+                if other['paths'] and other['hostname'] == website['hostname']]
+        return websites
+
+    def _get_origin_limit_whitelist(self, websites) -> list:
+        """Return the client addresses exempt from origin rate limits.
+
+        These are the origin_limit_whitelist option and the websites'
+        limit-whitelist, comma or space separated CIDRs.
+        """
+        whitelist = [self.config.get('origin_limit_whitelist') or '']
+        whitelist.extend(w['limit_whitelist'] or '' for w in websites)
+        return sorted(set(' '.join(whitelist).replace(',', ' ').split()))
+
+    def _get_cache_peers(self, domain="svc.cluster.local", relation=None) -> list:
+        """Return the addresses of a website's units.
+
+        `relation` defaults to the primary website. With peer_address_mode
+        'ip' the unit addresses Juju publishes on the relation are used so
+        squid needs no DNS lookup to reach a unit, falling back to the
+        unit's DNS name if the address isn't known yet.
+        """
+        if relation is None:
+            websites = self._get_websites()
+            if not websites:
+                return []
+            relation = websites[0]
+        use_ip = self._get_peer_address_mode() == 'ip'
         cache_peers = []
         svc_name = relation.data[relation.app]["service-name"]
         for peer in relation.units:
+            if use_ip:
+                address = relation.data[peer].get('ingress-address') or \
+                    relation.data[peer].get('private-address')
+                if address:
+                    cache_peers.append(address)
+                    continue
+                logger.warning("No address for %s yet, using its DNS name", peer.name)
             unit_name = peer.name.replace('/', '-')
             cache_peers.append(
                 f"{unit_name}.{svc_name}-endpoints.{self.model.name}.{domain}")
-        return cache_peers
+        # Keep the rendered config stable so squid is only reconfigured, and
+        # its standby connection pools rebuilt, when the units change.
+        return sorted(cache_peers)
+
+    def _get_peer_address_mode(self) -> str:
+        mode = self.config.get('peer_address_mode') or 'fqdn'
+        if mode not in self.PEER_ADDRESS_MODES:
+            logger.error(
+                "Ignoring unknown peer address mode %s, valid modes are %s",
+                mode, ", ".join(self.PEER_ADDRESS_MODES))
+            return 'fqdn'
+        return mode
+
+    def _get_siblings(self, domain="svc.cluster.local") -> list:
+        """Return the addresses of the other squid units."""
+        relation = self.model.get_relation('cluster')
+        if not relation or not self.config.get('sibling_cache'):
+            return []
+        siblings = []
+        for unit in relation.units:
+            unit_name = unit.name.replace('/', '-')
+            siblings.append(
+                f"{unit_name}.{self.app.name}-endpoints.{self.model.name}.{domain}")
+        return sorted(siblings)
+
+    def _get_sibling_addresses(self) -> list:
+        """Return the IP addresses of the other squid units.
+
+        Only these may use the sibling port, which would otherwise be an
+        open proxy to anything in localnet.
+        """
+        relation = self.model.get_relation('cluster')
+        if not relation or not self.config.get('sibling_cache'):
+            return []
+        addresses = []
+        for unit in relation.units:
+            address = relation.data[unit].get('ingress-address') or \
+                relation.data[unit].get('private-address')
+            if address:
+                addresses.append(address)
+        return sorted(addresses)
 
     def _get_ingress_config_from_relation(self) -> dict:
-        return self._get_data_from_relation(
-            'ingress-proxy',
-            REQUIRED_INGRESS_RELATION_FIELDS,
-            OPTIONAL_INGRESS_RELATION_FIELDS)
+        websites = self._get_websites()
+        if not websites:
+            return {}
+        return self._get_website_config(websites[0])
 
     def _get_squid_config_from_relation(self) -> dict:
+        """Merge the cache-settings of every website.
+
+        Where websites disagree on a setting the earliest related website
+        wins, refresh-patterns from all websites are kept.
+        """
         cache_settings = {}
-        relation_data = self._get_data_from_relation(
-            'ingress-proxy',
-            ['cache-settings'])
-        try:
-            cache_settings = json.loads(relation_data['cache-settings'])
-        except KeyError:
-            pass
+        for relation in self._get_websites():
+            relation_data = self._get_data_from_relation(
+                relation,
+                ['cache-settings'])
+            try:
+                website_settings = json.loads(relation_data['cache-settings'])
+            except KeyError:
+                continue
+            refresh_patterns = cache_settings.get('refresh-patterns', []) + \
+                website_settings.get('refresh-patterns', [])
+            cache_settings = dict(website_settings, **cache_settings)
+            if refresh_patterns:
+                cache_settings['refresh-patterns'] = refresh_patterns
         return cache_settings
 
 
@@ -0,0 +1,240 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+"""Single pass analysis of squid access logs.
+
+Logs are parsed with the squid logformat they were written with and are
+streamed line by line. Memory use is bounded however large the log is:
+per URL counts are kept with the Misra-Gries algorithm, which keeps a
+fixed number of counters and still finds the most frequent URLs.
+"""
+
+import collections
+import re
+import urllib.parse
+
+# A logformat code, eg %>a, %{Referer}>h or %03tu.
+LOGFORMAT_CODE_RE = re.compile(
+    r'%[-"\[#\']?[0-9.]*(?:\{[^}]*\})?(?:[<>]{0,2}[a-zA-Z]+|%)')
+
+# Named groups for the logformat codes used by the analysis.
+LOGFORMAT_FIELDS = {
+    '%rm': 'method',
+    '%ru': 'url',
+    '%>ru': 'url',
+    '%>Hs': 'status',
+    '%Hs': 'status',
+    '%<st': 'bytes',
+    '%st': 'bytes',
+    '%Ss': 'result',
+    '%mt': 'content_type',
+    '%{Content-Type}<h': 'content_type',
+}
+
+# Requests whose content was unchanged when revalidated with the origin.
+REVALIDATE_HIT_RESULTS = {
+    'TCP_REFRESH_UNMODIFIED',
+    'TCP_REFRESH_IGNORED',
+}
+
+# Extensions of static content which is a candidate for longer caching.
+STATIC_EXTENSIONS = {
+    'css', 'js', 'png', 'jpg', 'jpeg', 'gif', 'svg', 'ico', 'webp',
+    'woff', 'woff2', 'ttf', 'eot', 'mp4', 'webm', 'mp3', 'pdf', 'zip',
+}
+
+
+def logformat_regex(log_format):
+    """Compile a regex parsing lines written with squid `log_format`.
+
+    Each code matches up to the literal character following it, codes the
+    analysis uses are captured in named groups.
+    """
+    pattern = '^'
+    position = 0
+    seen = set()
+    codes = list(LOGFORMAT_CODE_RE.finditer(log_format))
+    for code in codes:
+        pattern += re.escape(log_format[position:code.start()])
+        position = code.end()
+        following = log_format[position:position + 1]
+        value = f'[^{re.escape(following)}]*' if following else '.*'
+        name = LOGFORMAT_FIELDS.get(code.group(0))
+        if name and name not in seen:
+            seen.add(name)
+            pattern += f'(?P<{name}>{value})'
+        else:
+            pattern += value
+    pattern += re.escape(log_format[position:]) + '$'
+    return re.compile(pattern)
+
+
+def classify(result) -> str:
+    """Classify a %Ss result code as hit, revalidate, miss or other."""
+    if 'REFRESH' in result:
+        return 'revalidate'
+    if 'HIT' in result:
+        return 'hit'
+    if 'MISS' in result:
+        return 'miss'
+    return 'other'
+
+
+def url_pattern(url) -> tuple:
+    """Group a URL by host, top level directory and extension."""
+    parsed = urllib.parse.urlsplit(url)
+    path = parsed.path
+    segments = [s for s in path.split('/') if s]
+    directory = f'/{segments[0]}/' if len(segments) > 1 else '/'
+    last = segments[-1] if segments else ''
+    extension = last.rsplit('.', 1)[1].lower() if '.' in last else ''
+    return parsed.netloc, directory, extension
+
+
+class HeavyHitters:
+    """Approximate top-k counter using a fixed number of counters.
+
+    Counts are underestimated by at most n / capacity for n added keys.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, key) -> None:
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = 1
+        else:
+            # Decrement every counter, dropping those reaching zero. Each
+            # decrement cancels an earlier increment so this is amortised
+            # constant time per key.
+            self.counts = {k: c - 1 for k, c in self.counts.items() if c > 1}
+
+    def top(self, n) -> list:
+        return collections.Counter(self.counts).most_common(n)
+
+
+class AccessLogAnalyser:
+    """Accumulate cache statistics from access log lines."""
+
+    # Upper bounds on the number of keys kept, anything further is
+    # counted under "other".
+    MAX_PATTERNS = 1000
+    MAX_CONTENT_TYPES = 200
+
+    def __init__(self, log_format, top_capacity=1000):
+        self.regex = logformat_regex(log_format)
+        if 'url' not in self.regex.groupindex or 'result' not in self.regex.groupindex:
+            raise ValueError('log format must include %ru and %Ss')
+        self.lines = 0
+        self.unparsed = 0
+        self.totals = collections.Counter()
+        self.patterns = collections.defaultdict(collections.Counter)
+        self.content_types = collections.defaultdict(collections.Counter)
+        self.missed = HeavyHitters(top_capacity)
+        self.revalidated = HeavyHitters(top_capacity)
+
+    def _bounded_key(self, mapping, key, limit):
+        if key in mapping or len(mapping) < limit:
+            return key
+        return 'other'
+
+    def add_line(self, line) -> None:
+        self.lines += 1
+        match = self.regex.match(line.rstrip('\n'))
+        if not match:
+            self.unparsed += 1
+            return
+        url = match.group('url')
+        category = classify(match.group('result'))
+        self.totals[category] += 1
+        host, directory, extension = url_pattern(url)
+        pattern = self._bounded_key(
+            self.patterns, (host, directory, extension), self.MAX_PATTERNS)
+        self.patterns[pattern][category] += 1
+        if 'content_type' in self.regex.groupindex:
+            content_type = match.group('content_type').split(';')[0].strip() or '-'
+        else:
+            content_type = f'.{extension}' if extension else '-'
+        content_type = self._bounded_key(
+            self.content_types, content_type, self.MAX_CONTENT_TYPES)
+        self.content_types[content_type][category] += 1
+        if category == 'miss':
+            self.missed.add(url)
+        elif category == 'revalidate':
+            self.revalidated.add(url)
+            if match.group('result') in REVALIDATE_HIT_RESULTS:
+                self.patterns[pattern]['revalidate_unmodified'] += 1
+
+    def add_lines(self, lines) -> None:
+        for line in lines:
+            self.add_line(line)
+
+    @staticmethod
+    def _ratios(counter) -> dict:
+        requests = sum(counter[c] for c in ('hit', 'revalidate', 'miss', 'other'))
+        ratios = {'requests': requests}
+        for category in ('hit', 'revalidate', 'miss'):
+            ratios[category] = round(counter[category] / requests, 4) if requests else 0
+        return ratios
+
+    def _pattern_name(self, pattern) -> str:
+        if pattern == 'other':
+            return 'other'
+        host, directory, extension = pattern
+        return f"{host}{directory}*{'.' + extension if extension else ''}"
+
+    def suggest_refresh_patterns(self, min_requests=100) -> list:
+        """Suggest refresh-patterns entries for static extensions.
+
+        Extensions often revalidated with the origin only to find the
+        content unchanged, or often missed, are suggested a longer
+        freshness lifetime. Entries use the shape of the refresh-patterns
+        list in the cache-settings relation data.
+        """
+        by_extension = collections.defaultdict(collections.Counter)
+        for pattern, counter in self.patterns.items():
+            if pattern != 'other' and pattern[2] in STATIC_EXTENSIONS:
+                by_extension[pattern[2]].update(counter)
+        suggestions = []
+        for extension, counter in sorted(by_extension.items()):
+            ratios = self._ratios(counter)
+            if ratios['requests'] < min_requests:
+                continue
+            unmodified = counter['revalidate_unmodified'] / ratios['requests']
+            if unmodified < 0.1 and ratios['miss'] < 0.5:
+                continue
+            suggestions.append({
+                'regex': f'\\.{extension}$',
+                # Rendered with -i so upper case extensions match too.
+                'case_sensitive': True,
+                'min': 1440,
+                'percent': 50,
+                'max': 10080,
+                'options': []})
+        return suggestions
+
+    def report(self, top=20, min_requests=100) -> dict:
+        """Return the statistics gathered so far."""
+        patterns = sorted(
+            self.patterns.items(),
+            key=lambda item: -sum(item[1].values()))
+        content_types = sorted(
+            self.content_types.items(),
+            key=lambda item: -sum(item[1].values()))
+        return {
+            'lines': self.lines,
+            'unparsed': self.unparsed,
+            'totals': self._ratios(self.totals),
+            'patterns': {
+                self._pattern_name(p): self._ratios(c)
+                for p, c in patterns[:top]},
+            'content-types': {
+                t: self._ratios(c) for t, c in content_types[:top]},
+            'most-missed': self.missed.top(top),
+            'most-revalidated': self.revalidated.top(top),
+            'suggested-refresh-patterns': self.suggest_refresh_patterns(
+                min_requests),
+        }
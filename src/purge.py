@@ -0,0 +1,102 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+"""Remove objects from the local squid cache.
+
+Squid's objects page only gives the URL of objects with in-memory state,
+objects only on disk are listed by their store key alone. URLs for those
+are taken from the access log instead, which only covers the objects
+requested since the log was last rotated.
+"""
+
+import re
+import urllib.error
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+
+import log_analysis
+import squid_client
+
+# Request lines in the cache manager objects page, eg
+#     GET http://mydomain.external.com/index.html
+OBJECT_URL_RE = re.compile(r'^\s+(?:GET|HEAD) (\S+)')
+
+
+def list_cached_urls(manager_port, timeout=30, counts=None):
+    """Yield the URL of every object in the cache which squid lists.
+
+    The objects page lists the whole store so it is streamed rather than
+    read in one go. A URL cached for both GET and HEAD is yielded twice.
+    If `counts` is given its 'objects' and 'unlisted' keys are set to the
+    number of objects and the number of those without a URL.
+    """
+    objects = unlisted = 0
+    listed = True
+    with squid_client.open_manager_page('objects', manager_port, timeout) as page:
+        for line in page:
+            line = line.decode('utf-8', 'replace')
+            if line.startswith('KEY '):
+                objects += 1
+                unlisted += not listed
+                listed = False
+                continue
+            match = OBJECT_URL_RE.match(line)
+            if match:
+                listed = True
+                yield match.group(1)
+    if counts is not None:
+        counts['objects'] = objects
+        counts['unlisted'] = unlisted + (objects > 0 and not listed)
+
+
+def logged_urls(lines, log_format):
+    """Yield the URL of each request in access log `lines`.
+
+    Raises ValueError if `log_format` has no %ru.
+    """
+    regex = log_analysis.logformat_regex(log_format)
+    if 'url' not in regex.groupindex:
+        raise ValueError('log format must include %ru')
+    for line in lines:
+        match = regex.match(line.rstrip('\n'))
+        if match:
+            yield match.group('url')
+
+
+def select_urls(cached_urls, prefixes=None, regexes=None) -> list:
+    """Return the cached URLs starting with a prefix or matching a regex.
+
+    Raises re.error if a regex is invalid.
+    """
+    prefixes = tuple(prefixes or [])
+    regexes = [re.compile(r) for r in regexes or []]
+    selected = (
+        url for url in cached_urls
+        if url.startswith(prefixes) or any(r.search(url) for r in regexes))
+    return list(dict.fromkeys(selected))
+
+
+def purge_url(url, port, default_host, timeout=30) -> dict:
+    """Send a PURGE for `url` to squid.
+
+    Squid answers 200 if the object was removed and 404 if it was not
+    cached.
+    """
+    request = squid_client.local_request(
+        url, port, default_host, method='PURGE')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return {'url': url, 'status': response.status}
+    except urllib.error.HTTPError as e:
+        return {'url': url, 'status': e.code}
+    except (urllib.error.URLError, OSError) as e:
+        return {'url': url, 'status': None, 'error': str(e)}
+
+
+def purge(urls, port, default_host, concurrency=4, timeout=30) -> list:
+    """Purge `urls` with at most `concurrency` requests in flight."""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(
+            lambda url: purge_url(url, port, default_host, timeout),
+            urls))
@@ -0,0 +1,165 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+"""Validate, deduplicate and order refresh-patterns entries.
+
+Squid tries each refresh_pattern regex in order against every URL it
+caches until one matches, so the list is kept short and the patterns
+matching most often are moved to the front. A pattern is only moved in
+front of another when no URL can match both, so the first matching
+pattern for every URL, and so squid's behaviour, is unchanged.
+
+Regexes are checked with Python's re module, squid uses POSIX extended
+regexes which agree with it for the patterns used in practice.
+"""
+
+import re
+
+# Regexes matching any URL.
+MATCH_ALL = {'', '.', '^', '.*', '^.*'}
+
+# Characters with a special meaning in a regex, besides an escaped ".".
+REGEX_SPECIAL_RE = re.compile(r'[\\.^$*+?()\[\]{}|]')
+
+
+def _literal(regex):
+    """Return (prefix anchored, literal, suffix anchored) for plain regexes.
+
+    Returns None if the regex is anything other than an optionally
+    anchored literal string, in which "\\." stands for a literal dot.
+    """
+    prefix = regex.startswith('^')
+    suffix = regex.endswith('$') and not regex.endswith('\\$')
+    body = regex[1 if prefix else 0:len(regex) - 1 if suffix else len(regex)]
+    literal = body.replace('\\.', '\x00')
+    if REGEX_SPECIAL_RE.search(literal):
+        return None
+    return prefix, literal.replace('\x00', '.'), suffix
+
+
+def _case_insensitive(pattern) -> bool:
+    # On the relation a true case_sensitive has always rendered -i, so it
+    # marks the patterns matched case insensitively.
+    return bool(pattern.get('case_sensitive'))
+
+
+def _literals(first, second):
+    """Return the literal forms of two patterns, compared case insensitively
+    if either of them is."""
+    a = _literal(first['regex'])
+    b = _literal(second['regex'])
+    if a is None or b is None:
+        return None
+    if _case_insensitive(first) or _case_insensitive(second):
+        a = (a[0], a[1].lower(), a[2])
+        b = (b[0], b[1].lower(), b[2])
+    return a, b
+
+
+def shadows(earlier, later) -> bool:
+    """Whether every URL matching `later` is matched by `earlier` first."""
+    if earlier['regex'] in MATCH_ALL:
+        return True
+    if _case_insensitive(later) and not _case_insensitive(earlier):
+        return False
+    literals = _literals(earlier, later)
+    if literals is None:
+        return False
+    (e_prefix, e_literal, e_suffix), (l_prefix, l_literal, l_suffix) = literals
+    if e_prefix and e_suffix:
+        return l_prefix and l_suffix and e_literal == l_literal
+    if e_prefix:
+        return l_prefix and l_literal.startswith(e_literal)
+    if e_suffix:
+        return l_suffix and l_literal.endswith(e_literal)
+    return e_literal in l_literal
+
+
+def disjoint(first, second) -> bool:
+    """Whether no URL can match both patterns, so their order is irrelevant."""
+    literals = _literals(first, second)
+    if literals is None:
+        return False
+    (a_prefix, a_literal, a_suffix), (b_prefix, b_literal, b_suffix) = literals
+    if a_prefix and b_prefix and not (
+            a_literal.startswith(b_literal) or b_literal.startswith(a_literal)):
+        return True
+    if a_suffix and b_suffix and not (
+            a_literal.endswith(b_literal) or b_literal.endswith(a_literal)):
+        return True
+    return False
+
+
+def validate(pattern):
+    """Return why `pattern` is invalid, or None if it is valid."""
+    try:
+        re.compile(
+            pattern['regex'],
+            re.IGNORECASE if _case_insensitive(pattern) else 0)
+    except KeyError:
+        return 'missing regex'
+    except (re.error, TypeError) as e:
+        return f'invalid regex: {e}'
+    for key in ('min', 'percent', 'max'):
+        try:
+            if int(pattern[key]) < 0:
+                return f'negative {key}'
+        except KeyError:
+            return f'missing {key}'
+        except (TypeError, ValueError):
+            return f'{key} is not a number'
+    return None
+
+
+def optimise(patterns, counts=None) -> tuple:
+    """Return the refresh patterns to render and a report of the changes.
+
+    `counts` maps regexes to how many logged URLs they were the first
+    pattern to match, patterns without a count are left in place.
+    """
+    counts = counts or {}
+    report = {'invalid': [], 'duplicate': [], 'shadowed': [], 'reordered': False}
+    kept = []
+    for pattern in patterns or []:
+        error = validate(pattern)
+        if error:
+            report['invalid'].append({'regex': pattern.get('regex'), 'error': error})
+            continue
+        key = (pattern['regex'], _case_insensitive(pattern))
+        if key in ((p['regex'], _case_insensitive(p)) for p in kept):
+            report['duplicate'].append(pattern['regex'])
+            continue
+        shadowed_by = next((p for p in kept if shadows(p, pattern)), None)
+        if shadowed_by:
+            report['shadowed'].append({
+                'regex': pattern['regex'],
+                'by': shadowed_by['regex']})
+            continue
+        kept.append(pattern)
+    ordered = []
+    for pattern in kept:
+        # Insertion sort only moving a pattern past those it can't overlap.
+        position = len(ordered)
+        count = counts.get(pattern['regex'], 0)
+        while position > 0 and \
+                counts.get(ordered[position - 1]['regex'], 0) < count and \
+                disjoint(ordered[position - 1], pattern):
+            position -= 1
+        ordered.insert(position, pattern)
+    report['reordered'] = ordered != kept
+    return ordered, report
+
+
+def count_matches(patterns, urls) -> dict:
+    """Count the URLs each pattern is the first to match."""
+    compiled = [
+        (p['regex'], re.compile(
+            p['regex'], re.IGNORECASE if _case_insensitive(p) else 0))
+        for p in patterns]
+    counts = dict.fromkeys((regex for regex, _ in compiled), 0)
+    for url in urls:
+        for regex, pattern in compiled:
+            if pattern.search(url):
+                counts[regex] += 1
+                break
+    return counts
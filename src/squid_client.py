@@ -0,0 +1,39 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+"""Talk to the squid running in the payload container.
+
+The charm and squid containers share the pod network so squid is reached
+on localhost.
+"""
+
+import urllib.parse
+import urllib.request
+
+
+def local_request(url, port, default_host, method=None) -> urllib.request.Request:
+    """Return a request for `url` addressed to squid on localhost.
+
+    Squid is an accelerator so the original host is passed in the Host
+    header. URLs without a host use `default_host`.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    path = parsed.path or '/'
+    if parsed.query:
+        path = f"{path}?{parsed.query}"
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}{path}",
+        method=method)
+    request.add_header('Host', parsed.netloc or default_host)
+    return request
+
+
+def open_manager_page(page, manager_port, timeout=30):
+    """Open a cache manager page, eg 'info', and return the response.
+
+    The response is file like and is read line by line by callers, some
+    pages are very large.
+    """
+    return urllib.request.urlopen(
+        f"http://127.0.0.1:{manager_port}/squid-internal-mgr/{page}",
+        timeout=timeout)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+"""Prometheus exporter for squid's cache manager.
+
+This module only uses the standard library. The charm pushes it into the
+squid container and runs it as a Pebble service. The charm also uses its
+parsers to summarise squid's state in the unit status.
+"""
+
+import argparse
+import http.server
+import re
+import urllib.request
+
+# Lines of the form "client_http.requests = 120" in the counters page and
+# "client_http.requests = 0.400000/sec" in the 5min page.
+KEY_VALUE_RE = re.compile(r'^\s*([\w.]+) = (-?[0-9.]+(?:e[-+]?[0-9]+)?)')
+PERCENT_5MIN_RE = re.compile(r'5min: (-?[0-9.]+)%')
+FIRST_NUMBER_RE = re.compile(r'(-?[0-9.]+)')
+
+# Lines of the info page exported as gauges, mapped to metric names.
+INFO_GAUGES = {
+    'Number of clients accessing cache': 'squid_clients',
+    'Storage Swap size': 'squid_disk_store_kilobytes',
+    'Storage Mem size': 'squid_memory_store_kilobytes',
+    'Mean Object Size': 'squid_mean_object_size_kilobytes',
+    'Maximum number of file descriptors': 'squid_file_descriptors_max',
+    'Number of file desc currently in use': 'squid_file_descriptors_in_use',
+    'Largest file desc currently in use': 'squid_file_descriptors_largest',
+    'Files queued for open': 'squid_files_queued',
+}
+
+# Lines of the info page giving a 5 minute percentage, exported as ratios.
+INFO_RATIOS = {
+    'Hits as % of all requests': 'squid_hit_ratio',
+    'Hits as % of bytes sent': 'squid_byte_hit_ratio',
+    'Memory hits as % of hit requests': 'squid_memory_hit_ratio',
+    'Disk hits as % of hit requests': 'squid_disk_hit_ratio',
+}
+
+# Rows of the "Median Service Times" table in the info page.
+MEDIAN_SERVICE_TIMES = {
+    'HTTP Requests (All)': 'all',
+    'Cache Misses': 'misses',
+    'Cache Hits': 'hits',
+    'Near Hits': 'near_hits',
+    'Not-Modified Replies': 'not_modified',
+    'DNS Lookups': 'dns',
+}
+
+
+def parse_key_values(lines) -> dict:
+    """Parse the counters or 5min cache manager page."""
+    values = {}
+    for line in lines:
+        match = KEY_VALUE_RE.match(line)
+        if match:
+            values[match.group(1)] = float(match.group(2))
+    return values
+
+
+def parse_info(lines) -> dict:
+    """Parse the info cache manager page into metric values.
+
+    Keys are metric names, median service times are keyed by
+    ('squid_median_service_time_seconds', <request type>).
+    """
+    metrics = {}
+    for line in lines:
+        if ':' not in line:
+            continue
+        name, value = (part.strip() for part in line.split(':', 1))
+        if name in INFO_RATIOS:
+            match = PERCENT_5MIN_RE.search(value)
+            if match:
+                metrics[INFO_RATIOS[name]] = float(match.group(1)) / 100
+        elif name in INFO_GAUGES:
+            match = FIRST_NUMBER_RE.search(value)
+            if match:
+                metrics[INFO_GAUGES[name]] = float(match.group(1))
+        elif name in MEDIAN_SERVICE_TIMES:
+            # "HTTP Requests (All):   0.00179  0.00091", 5 and 60 minute.
+            match = FIRST_NUMBER_RE.search(value)
+            if match:
+                key = (
+                    'squid_median_service_time_seconds',
+                    MEDIAN_SERVICE_TIMES[name])
+                metrics[key] = float(match.group(1))
+    return metrics
+
+
+def _metric_name(key) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', key)
+
+
+def format_metrics(info, counters, five_min) -> str:
+    """Render parsed cache manager pages in the Prometheus text format."""
+    lines = []
+    for key, value in sorted(info.items(), key=str):
+        if isinstance(key, tuple):
+            lines.append(f'{key[0]}{{type="{key[1]}"}} {value}')
+        else:
+            lines.append(f'{key} {value}')
+    if 'client_http.requests' in five_min:
+        lines.append(
+            f"squid_requests_per_second {five_min['client_http.requests']}")
+    for key, value in sorted(counters.items()):
+        if key == 'sample_time':
+            continue
+        lines.append(f'squid_{_metric_name(key)}_total {value}')
+    for key, value in sorted(five_min.items()):
+        if key in ('sample_start_time', 'sample_end_time'):
+            continue
+        lines.append(f'squid_5min_{_metric_name(key)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def read_page(page, manager_port, timeout=10) -> list:
+    """Return the lines of a cache manager page."""
+    with urllib.request.urlopen(
+            f"http://127.0.0.1:{manager_port}/squid-internal-mgr/{page}",
+            timeout=timeout) as response:
+        return response.read().decode('utf-8', 'replace').splitlines()
+
+
+def collect(manager_port) -> str:
+    """Scrape squid and return its metrics in the Prometheus text format."""
+    return format_metrics(
+        parse_info(read_page('info', manager_port)),
+        parse_key_values(read_page('counters', manager_port)),
+        parse_key_values(read_page('5min', manager_port)))
+
+
+def serve(port, manager_port) -> None:
+    """Serve squid's metrics on /metrics until killed."""
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            try:
+                body = collect(manager_port).encode()
+                up = 1
+            except OSError:
+                body = b''
+                up = 0
+            body += f'squid_up {up}\n'.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    http.server.ThreadingHTTPServer(('', port), MetricsHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=9301)
+    parser.add_argument('--manager-port', type=int, default=3130)
+    args = parser.parse_args()
+    serve(args.port, args.manager_port)
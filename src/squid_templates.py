@@ -19,17 +19,71 @@ acl Safe_ports port 488		# gss-http
 acl Safe_ports port 591		# filemaker
 acl Safe_ports port 777		# multiling http
 acl CONNECT method CONNECT
+acl PURGE method PURGE
 http_access deny !Safe_ports
 http_access deny CONNECT !SSL_ports
 http_access allow localhost manager
 http_access deny manager
+http_access allow localhost PURGE
+http_access deny PURGE
+{% if siblings -%}
+acl sibling_port myportname sibling
+{% if sibling_addresses -%}
+acl siblings src {{ sibling_addresses|join(' ') }}
+http_access allow sibling_port siblings
+{% endif -%}
+http_access deny sibling_port
+miss_access deny sibling_port
+{% endif -%}
 include /etc/squid/conf.d/*
 http_access allow localhost
 http_access allow localnet
 http_access deny all
 coredump_dir /var/spool/squid
-{% if log_format -%}
+http_port 127.0.0.1:{{ manager_port }}
+{% if workers > 1 -%}
+workers {{ workers }}
+memory_cache_shared on
+{% endif -%}
+{% if cache_mem -%}
+cache_mem {{ cache_mem }}
+{% endif -%}
+{% if maximum_object_size_in_memory -%}
+maximum_object_size_in_memory {{ maximum_object_size_in_memory }}
+{% endif -%}
+{% if maximum_object_size -%}
+maximum_object_size {{ maximum_object_size }}
+{% endif -%}
+{% if memory_replacement_policy -%}
+memory_replacement_policy {{ memory_replacement_policy }}
+{% endif -%}
+{% if cache_replacement_policy -%}
+cache_replacement_policy {{ cache_replacement_policy }}
+{% endif -%}
+{% if cache_dir_size -%}
+{% if workers > 1 -%}
+cache_dir rock /var/spool/squid {{ cache_dir_size }}{% if cache_dir_min_size %} min-size={{ cache_dir_min_size }}{% endif %}
+{% else -%}
+cache_dir ufs /var/spool/squid {{ cache_dir_size }} 16 256{% if cache_dir_min_size %} min-size={{ cache_dir_min_size }}{% endif %}
+{% endif -%}
+{% endif -%}
+{% if range_offset_limit -%}
+range_offset_limit {{ range_offset_limit }}
+{% if range_offset_limit|string == '-1' -%}
+quick_abort_min -1 KB
+{% endif -%}
+{% endif -%}
+{% if access_log_mode == 'off' -%}
+access_log none
+{% elif log_format -%}
 logformat combined {{ log_format }}
+{% if access_log_sample -%}
+acl access_log_sample random {{ access_log_sample }}
+{% endif -%}
+{% if '!access_log_hit' in access_log_acls -%}
+acl access_log_hit hier_code HIER_NONE
+{% endif -%}
+access_log {{ access_log_destination }} logformat=combined{% for option in access_log_options %} {{ option }}{% endfor %}{% for acl in access_log_acls %} {{ acl }}{% endfor %}
 {% endif -%}
 {% if refresh_patterns -%}
 {% for refresh_pattern in refresh_patterns -%}
@@ -41,11 +95,116 @@ refresh_pattern {{ refresh_pattern.regex }} {{ refresh_pattern.min }} {{ refresh
 {% endfor -%}
 {% endif -%}
 refresh_pattern . 0 20% 4320
-{% if port %}
+{% if store_id_program -%}
+store_id_program {{ store_id_program }}
+store_id_children 5 startup=1 idle=1 concurrency=100
+{% endif -%}
+dns_defnames off
+{% if dns_v4_first -%}
+dns_v4_first on
+{% endif -%}
+{% if dns_ipcache_size -%}
+ipcache_size {{ dns_ipcache_size }}
+{% endif -%}
+{% if dns_positive_ttl -%}
+positive_dns_ttl {{ dns_positive_ttl }}
+{% endif -%}
+{% if dns_negative_ttl -%}
+negative_dns_ttl {{ dns_negative_ttl }}
+{% endif -%}
+{% if collapsed_forwarding -%}
+collapsed_forwarding on
+{% endif -%}
+{% if max_stale -%}
+max_stale {{ max_stale }}
+{% endif -%}
+{% if server_persistent_connections is sameas false -%}
+server_persistent_connections off
+{% endif -%}
+{% if client_persistent_connections is sameas false -%}
+client_persistent_connections off
+{% endif -%}
+{% if server_idle_pconn_timeout -%}
+server_idle_pconn_timeout {{ server_idle_pconn_timeout }}
+{% endif -%}
+{% if client_idle_pconn_timeout -%}
+client_idle_pconn_timeout {{ client_idle_pconn_timeout }}
+{% endif -%}
+{% if siblings -%}
+http_port {{ sibling_port }} name=sibling
+{% if sibling_protocol == 'htcp' -%}
+htcp_port {{ htcp_port }}
+{% if sibling_addresses -%}
+htcp_access allow siblings
+{% endif -%}
+htcp_access deny all
+{% for sibling in siblings -%}
+cache_peer {{ sibling }} sibling {{ sibling_port }} {{ htcp_port }} htcp proxy-only
+{% endfor -%}
+{% else -%}
+digest_generation on
+{% for sibling in siblings -%}
+cache_peer {{ sibling }} sibling {{ sibling_port }} 0 no-query proxy-only
+{% endfor -%}
+{% endif -%}
+{% endif -%}
+{% if websites %}
+{% for port in ports -%}
 http_port {{ port }} accel
-{% for peer in peers -%}
-cache_peer {{ peer }} parent {{ port }} 0 no-query originserver
 {% endfor -%}
+{% if never_direct -%}
+never_direct allow all
+{% endif -%}
+{% if routing -%}
+{% for website in websites -%}
+acl {{ website.name }}_host dstdomain {{ website.hostname }}
+{% if website.paths -%}
+acl {{ website.name }}_path urlpath_regex {{ website.paths|join(' ') }}
+{% endif -%}
+{% endfor -%}
+{% endif -%}
+{% for website in websites -%}
+{% for peer in website.peers -%}
+{% set peer_name = website.name ~ '_' ~ loop.index0 -%}
+cache_peer {{ peer }} parent {{ website.port }} 0 no-query originserver{% if routing %} name={{ peer_name }}{% endif %}{% if peer_options %} {{ peer_options|join(' ') }}{% endif %}{% if origin_max_connections %} max-conn={{ origin_max_connections }}{% endif %}
+{% if routing -%}
+{% for excluded in website.excluded -%}
+cache_peer_access {{ peer_name }} deny {{ website.name }}_host {{ excluded }}_path
+{% endfor -%}
+cache_peer_access {{ peer_name }} allow {{ website.name }}_host{% if website.paths %} {{ website.name }}_path{% endif %}
+cache_peer_access {{ peer_name }} deny all
+{% endif -%}
+{% endfor -%}
+{% endfor -%}
+{% if origin_max_bytes_per_second -%}
+{% if origin_limit_exempt -%}
+acl origin_limit_exempt src {{ origin_limit_exempt|join(' ') }}
+{% endif -%}
+{% set limited = websites if routing else websites[:1] -%}
+delay_pools {{ limited|length }}
+{% for website in limited -%}
+delay_class {{ loop.index }} 1
+delay_parameters {{ loop.index }} {{ origin_max_bytes_per_second }}/{{ origin_max_bytes_per_second }}
+{% if origin_limit_exempt -%}
+delay_access {{ loop.index }} deny origin_limit_exempt
+{% endif -%}
+{% if routing -%}
+{% for excluded in website.excluded -%}
+delay_access {{ loop.index }} deny {{ website.name }}_host {{ excluded }}_path
+{% endfor -%}
+delay_access {{ loop.index }} allow {{ website.name }}_host{% if website.paths %} {{ website.name }}_path{% endif %}
+{% else -%}
+delay_access {{ loop.index }} allow all
+{% endif -%}
+delay_access {{ loop.index }} deny all
+{% endfor -%}
+{% endif -%}
+{% if retry_on_error -%}
+retry_on_error on
+{% endif -%}
+{% if forward_max_tries -%}
+forward_max_tries {{ forward_max_tries }}
+{% endif -%}
 {% endif %}
 
 """ # noqa
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+"""Squid store_id_program normalising cache keys.
+
+URLs which only differ by ignored query parameters or the order of their
+query parameters are given the same store ID so squid keeps one copy.
+The charm pushes this script into the squid container, it only uses the
+standard library.
+
+Squid writes one request per line, prefixed with a channel ID as the
+helper is run with concurrency, and reads back "<channel> OK
+store-id=<url>" or "<channel> ERR" if the URL is kept as it is.
+"""
+
+import argparse
+import fnmatch
+import sys
+import urllib.parse
+
+
+def normalise_url(url, strip_params=(), sort_query=False) -> str:
+    """Return the store ID for `url`.
+
+    Query parameters with a name matching a glob in `strip_params`, eg
+    "utm_*", are removed and the remaining ones are sorted if
+    `sort_query` is set. Parameters are not decoded so their values are
+    kept byte for byte.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if not parsed.query:
+        return url
+    params = [p for p in parsed.query.split('&') if p]
+    if strip_params:
+        params = [
+            p for p in params
+            if not any(
+                fnmatch.fnmatchcase(urllib.parse.unquote_plus(p.split('=', 1)[0]), glob)
+                for glob in strip_params)]
+    if sort_query:
+        params.sort()
+    return urllib.parse.urlunsplit(parsed._replace(query='&'.join(params)))
+
+
+def handle_line(line, strip_params=(), sort_query=False) -> str:
+    """Return squid's answer to a request line."""
+    fields = line.split()
+    if len(fields) < 2:
+        return f"{fields[0] if fields else ''} BH message=\"malformed request\""
+    channel, url = fields[0], fields[1]
+    store_id = normalise_url(url, strip_params, sort_query)
+    if store_id == url:
+        return f"{channel} ERR"
+    return f"{channel} OK store-id={store_id}"
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--strip-params', nargs='*', default=[],
+        help='Globs of query parameter names to remove')
+    parser.add_argument(
+        '--sort-query', action='store_true',
+        help='Sort the query parameters')
+    args = parser.parse_args(args)
+    for line in sys.stdin:
+        sys.stdout.write(
+            handle_line(line, args.strip_params, args.sort_query) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
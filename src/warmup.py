@@ -0,0 +1,109 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+"""Pre-fill the local squid cache by fetching URLs through it."""
+
+import time
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ElementTree
+
+from concurrent.futures import ThreadPoolExecutor
+
+import squid_client
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class SitemapError(Exception):
+    """A sitemap could not be fetched or parsed."""
+
+
+def _cache_result(headers) -> str:
+    """Return squid's cache result from the X-Cache response header."""
+    x_cache = headers.get('X-Cache', '') if headers else ''
+    if x_cache.startswith('HIT'):
+        return 'TCP_HIT'
+    if x_cache.startswith('MISS'):
+        return 'TCP_MISS'
+    return 'NONE'
+
+
+def fetch(url, port, default_host, timeout=30) -> dict:
+    """Fetch `url` through squid, discarding the body.
+
+    Returns a dict with the url, HTTP status, bytes read, cache result and
+    time taken.
+    """
+    result = {'url': url, 'status': None, 'bytes': 0, 'result': 'NONE'}
+    start = time.monotonic()
+    try:
+        response = urllib.request.urlopen(
+            squid_client.local_request(url, port, default_host),
+            timeout=timeout)
+    except urllib.error.HTTPError as e:
+        response = e
+    except (urllib.error.URLError, OSError) as e:
+        result['error'] = str(e)
+        result['time'] = round(time.monotonic() - start, 3)
+        return result
+    with response:
+        result['status'] = response.status
+        result['result'] = _cache_result(response.headers)
+        try:
+            while True:
+                chunk = response.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                result['bytes'] += len(chunk)
+        except OSError as e:
+            result['error'] = str(e)
+    result['time'] = round(time.monotonic() - start, 3)
+    return result
+
+
+def parse_sitemap(content) -> tuple:
+    """Parse a sitemap or sitemap index.
+
+    Returns a tuple of the page URLs and the URLs of any child sitemaps.
+    """
+    root = ElementTree.fromstring(content)
+    locs = [
+        element.text.strip() for element in root.iter()
+        if element.tag.endswith('loc') and element.text]
+    if root.tag.endswith('sitemapindex'):
+        return [], locs
+    return locs, []
+
+
+def get_sitemap_urls(sitemap_url, port, default_host, timeout=30) -> list:
+    """Return the page URLs listed in a sitemap fetched through squid.
+
+    A sitemap index is followed one level down. Raises SitemapError if a
+    sitemap cannot be fetched or parsed.
+    """
+    urls = []
+    sitemaps = [sitemap_url]
+    followed = False
+    while sitemaps:
+        sitemap = sitemaps.pop(0)
+        try:
+            with urllib.request.urlopen(
+                    squid_client.local_request(sitemap, port, default_host),
+                    timeout=timeout) as response:
+                pages, children = parse_sitemap(response.read())
+        except (OSError, ElementTree.ParseError) as e:
+            raise SitemapError(f"{sitemap}: {e}")
+        urls.extend(pages)
+        if not followed:
+            sitemaps.extend(children)
+            followed = True
+    return urls
+
+
+def warm(urls, port, default_host, concurrency=4, timeout=30) -> list:
+    """Fetch `urls` through squid with at most `concurrency` in flight."""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(
+            lambda url: fetch(url, port, default_host, timeout),
+            urls))
@@ -0,0 +1,110 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+import unittest
+
+import cache_simulator
+
+LOG_FORMAT = '%rm %ru %<st'
+
+
+class TestCacheSimulator(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(cache_simulator.parse_size('256 MB'), 256 * 1024 ** 2)
+        self.assertEqual(cache_simulator.parse_size('1.5KB'), 1536)
+        self.assertEqual(cache_simulator.parse_size(100), 100)
+        with self.assertRaises(ValueError):
+            cache_simulator.parse_size('1 XB')
+
+    def test_lru(self):
+        cache = cache_simulator.LRUCache(300)
+        self.assertFalse(cache.request(1, 100))
+        self.assertFalse(cache.request(2, 100))
+        self.assertTrue(cache.request(1, 100))
+        self.assertFalse(cache.request(3, 200))
+        # 2 was least recently used.
+        self.assertFalse(cache.request(2, 100))
+        self.assertEqual(cache.used, 300)
+        # Too large to cache.
+        self.assertFalse(cache.request(4, 400))
+        self.assertFalse(cache.request(4, 400))
+        # Looking up without a size never caches.
+        self.assertFalse(cache.request(5, None))
+        self.assertNotIn(5, cache.objects)
+        self.assertTrue(cache.request(2, None))
+        self.assertEqual(cache.objects[2], 100)
+
+    def test_gdsf_keeps_small_popular_objects(self):
+        cache = cache_simulator.HeapCache(1000, 'gdsf')
+        cache.request(1, 100)
+        cache.request(1, 100)
+        cache.request(2, 800)
+        cache.request(3, 200)
+        self.assertTrue(cache.request(1, 100))
+        self.assertFalse(cache.request(2, 800))
+
+    def test_lfuda_keeps_frequent_objects(self):
+        cache = cache_simulator.HeapCache(300, 'lfuda')
+        for _ in range(3):
+            cache.request(1, 100)
+        cache.request(2, 100)
+        cache.request(3, 100)
+        cache.request(4, 100)
+        self.assertTrue(cache.request(1, 100))
+        self.assertEqual(cache.used, 300)
+
+    def test_heap_rebuilt(self):
+        cache = cache_simulator.HeapCache(1000, 'lfuda')
+        for _ in range(5000):
+            cache.request(1, 100)
+        self.assertLess(len(cache.heap), 2000)
+        self.assertTrue(cache.request(1, 100))
+
+    def test_simulator(self):
+        simulator = cache_simulator.Simulator(
+            LOG_FORMAT, ['1 KB', '10 KB'], ['lru'], max_object_size=4096)
+        simulator.add_lines([
+            'GET http://a/1 600\n',
+            'GET http://a/2 600\n',
+            'GET http://a/1 600\n',
+            'POST http://a/1 600\n',
+            'GET http://a/big 5000\n',
+            'garbage\n',
+        ])
+        report = simulator.report()
+        self.assertEqual(report['lines'], 6)
+        self.assertEqual(report['unparsed'], 1)
+        self.assertEqual(report['requests'], 5)
+        self.assertEqual(
+            report['results'],
+            [
+                {'size': '1 KB', 'policy': 'lru', 'hit-ratio': 0.0, 'byte-hit-ratio': 0.0},
+                {'size': '10 KB', 'policy': 'lru', 'hit-ratio': 0.2,
+                 'byte-hit-ratio': round(600 / 7400, 4)}])
+
+    def test_simulator_log_format(self):
+        with self.assertRaises(ValueError):
+            cache_simulator.Simulator('%rm %ru', ['1 MB'])
+        with self.assertRaises(ValueError):
+            cache_simulator.Simulator(LOG_FORMAT, ['1 MB'], ['fifo'])
+
+    def test_simulator_status(self):
+        simulator = cache_simulator.Simulator(
+            '%rm %ru %>Hs %<st', ['10 KB'], ['lru', 'gdsf'])
+        simulator.add_lines([
+            'GET http://a/1 200 600\n',
+            # Revalidations hit the cached object without resizing it.
+            'GET http://a/1 304 100\n',
+            'GET http://a/1 200 600\n',
+            # Errors and redirects are not the object.
+            'GET http://a/1 404 50\n',
+            'GET http://a/2 302 50\n',
+            'GET http://a/2 304 100\n',
+            'GET http://a/1 200 600\n',
+        ])
+        report = simulator.report()
+        self.assertEqual(report['requests'], 7)
+        for result in report['results']:
+            self.assertEqual(result['hit-ratio'], round(3 / 7, 4))
+            self.assertEqual(result['byte-hit-ratio'], round(1300 / 2100, 4))
@@ -0,0 +1,63 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+import io
+import unittest
+from unittest.mock import Mock
+
+from ops.pebble import PathError
+
+import cgroup
+
+
+def make_container(files):
+    def _pull(path):
+        try:
+            return io.StringIO(files[path])
+        except KeyError:
+            raise PathError('not-found', path)
+    container = Mock()
+    container.pull.side_effect = _pull
+    return container
+
+
+class TestCgroup(unittest.TestCase):
+
+    def test_get_memory_limit_v2(self):
+        container = make_container({
+            '/sys/fs/cgroup/memory.max': '1073741824\n'})
+        self.assertEqual(cgroup.get_memory_limit(container), 1073741824)
+        container = make_container({
+            '/sys/fs/cgroup/memory.max': 'max\n'})
+        self.assertIsNone(cgroup.get_memory_limit(container))
+
+    def test_get_memory_limit_v1(self):
+        container = make_container({
+            '/sys/fs/cgroup/memory/memory.limit_in_bytes': '536870912\n'})
+        self.assertEqual(cgroup.get_memory_limit(container), 536870912)
+        container = make_container({
+            '/sys/fs/cgroup/memory/memory.limit_in_bytes':
+                '9223372036854771712\n'})
+        self.assertIsNone(cgroup.get_memory_limit(container))
+
+    def test_get_memory_limit_missing(self):
+        self.assertIsNone(cgroup.get_memory_limit(make_container({})))
+
+    def test_get_cpu_limit_v2(self):
+        container = make_container({
+            '/sys/fs/cgroup/cpu.max': '200000 100000\n'})
+        self.assertEqual(cgroup.get_cpu_limit(container), 2.0)
+        container = make_container({
+            '/sys/fs/cgroup/cpu.max': 'max 100000\n'})
+        self.assertIsNone(cgroup.get_cpu_limit(container))
+
+    def test_get_cpu_limit_v1(self):
+        container = make_container({
+            '/sys/fs/cgroup/cpu/cpu.cfs_quota_us': '150000\n',
+            '/sys/fs/cgroup/cpu/cpu.cfs_period_us': '100000\n'})
+        self.assertEqual(cgroup.get_cpu_limit(container), 1.5)
+        container = make_container({
+            '/sys/fs/cgroup/cpu/cpu.cfs_quota_us': '-1\n',
+            '/sys/fs/cgroup/cpu/cpu.cfs_period_us': '100000\n'})
+        self.assertIsNone(cgroup.get_cpu_limit(container))
+        self.assertIsNone(cgroup.get_cpu_limit(make_container({})))
@@ -3,12 +3,15 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import io
 import unittest
 # from unittest.mock import Mock
+from unittest.mock import ANY, Mock, patch
 import json
+import yaml
 
 from charm import SquidIngressCacheCharm
-from ops.model import ActiveStatus
+from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
 from ops.testing import Harness
 
 import tests.test_data as test_data
@@ -18,6 +21,16 @@ class TestCharm(unittest.TestCase):
     def setUp(self):
         self.harness = Harness(SquidIngressCacheCharm)
         self.addCleanup(self.harness.cleanup)
+        # The test harness does not implement exec.
+        patcher = patch.object(SquidIngressCacheCharm, '_run_command')
+        self.run_command = patcher.start()
+        self.run_command.return_value = True
+        self.addCleanup(patcher.stop)
+        # Nor can it reach squid.
+        self.squid_ready_patcher = patch.object(SquidIngressCacheCharm, '_squid_ready')
+        self.squid_ready = self.squid_ready_patcher.start()
+        self.squid_ready.return_value = True
+        self.addCleanup(self.squid_ready_patcher.stop)
         self.harness.begin()
 
     def add_ingress_relation(self, cache_data=None):
@@ -76,6 +89,28 @@ class TestCharm(unittest.TestCase):
             self.harness.charm._get_cache_peers(),
             ['mywebsite-0.website-endpoints.None.svc.cluster.local'])
 
+    def test__get_cache_peers_ip(self):
+        rel_id = self.add_ingress_proxy_relation()
+        self.harness.add_relation_unit(rel_id, 'mywebsite/1')
+        self.harness.update_relation_data(
+            rel_id, 'mywebsite/0', {'ingress-address': '10.1.2.3'})
+        self.harness.update_config({'peer_address_mode': 'ip'})
+        # Units without a published address keep their DNS name.
+        self.assertEqual(
+            self.harness.charm._get_cache_peers(),
+            ['10.1.2.3', 'mywebsite-1.website-endpoints.None.svc.cluster.local'])
+        self.harness.update_relation_data(
+            rel_id, 'mywebsite/1', {'private-address': '10.1.2.4'})
+        self.assertEqual(
+            self.harness.charm._get_cache_peers(), ['10.1.2.3', '10.1.2.4'])
+        self.harness.update_config({'peer_address_mode': 'dns'})
+        with self.assertLogs(level='ERROR') as logger:
+            self.assertEqual(
+                self.harness.charm._get_cache_peers(),
+                ['mywebsite-0.website-endpoints.None.svc.cluster.local',
+                 'mywebsite-1.website-endpoints.None.svc.cluster.local'])
+        self.assertIn('unknown peer address mode dns', logger.output[0])
+
     def test_httpbin_pebble_ready(self):
         # Check the initial Pebble plan is empty
         initial_plan = self.harness.get_container_pebble_plan("squid")
@@ -106,13 +141,89 @@ class TestCharm(unittest.TestCase):
         # Ensure we set an ActiveStatus with no message
         self.assertEqual(self.harness.model.unit.status, ActiveStatus())
 
+    def test__configure_pebble_checks(self):
+        self.add_ingress_proxy_relation()
+        container = self.harness.model.unit.get_container("squid")
+        # The harness drops checks from layers, look at what is sent.
+        with patch.object(container, 'add_layer') as add_layer:
+            self.harness.charm.on.squid_pebble_ready.emit(container)
+        layer = yaml.safe_load(add_layer.call_args[0][1])
+        self.assertEqual(
+            layer['services']['squid']['on-check-failure'],
+            {'squid-alive': 'restart'})
+        self.assertEqual(layer['checks']['squid-ready']['level'], 'ready')
+        self.assertEqual(layer['checks']['squid-ready']['tcp'], {'port': 80})
+        # Readiness also needs the cache manager to answer.
+        self.assertEqual(
+            layer['checks']['squid-manager-ready']['level'], 'ready')
+        self.assertEqual(
+            layer['checks']['squid-manager-ready']['http'],
+            {'url': 'http://127.0.0.1:3130/squid-internal-mgr/info'})
+        self.assertEqual(layer['checks']['squid-alive']['level'], 'alive')
+        self.assertEqual(
+            layer['checks']['squid-alive']['http'],
+            {'url': 'http://127.0.0.1:3130/squid-internal-mgr/info'})
+
+    def test__configure_charm_waits_for_squid(self):
+        self.add_ingress_proxy_relation()
+        self.harness.set_leader(True)
+        self.add_ingress_relation()
+        self.squid_ready.return_value = False
+        with patch.object(self.harness.charm.ingress, 'update_config') as update_config:
+            self._start_squid()
+            self.squid_ready.assert_called_with(80)
+            # The Pebble ready check gates traffic, the ingress is not held.
+            update_config.assert_called_once()
+            self.assertEqual(
+                self.harness.model.unit.status,
+                WaitingStatus('Waiting for squid to start'))
+            self.squid_ready.return_value = True
+            with patch.object(
+                    self.harness.charm, '_get_status_summary') as summary:
+                summary.return_value = '12.5 req/s, 80% hit ratio'
+                self.harness.charm.on.update_status.emit()
+            self.assertEqual(
+                self.harness.model.unit.status,
+                ActiveStatus('12.5 req/s, 80% hit ratio'))
+
+    @patch('socket.create_connection')
+    @patch('squid_client.open_manager_page')
+    def test__squid_ready(self, open_manager_page, create_connection):
+        self.squid_ready_patcher.stop()
+        self.add_ingress_proxy_relation()
+        self._start_squid()
+        open_manager_page.return_value = io.BytesIO(b'Squid Object Cache\n')
+        self.assertTrue(self.harness.charm._squid_ready(80))
+        create_connection.assert_called_with(('127.0.0.1', 80), timeout=2)
+        create_connection.side_effect = ConnectionRefusedError('refused')
+        with self.assertLogs(level='INFO') as logger:
+            self.assertFalse(self.harness.charm._squid_ready(80))
+        self.assertIn('Squid is not ready: refused', logger.output[-1])
+        container = self.harness.model.unit.get_container("squid")
+        container.stop('squid')
+        self.assertFalse(self.harness.charm._squid_ready(80))
+
+    @patch('squid_client.open_manager_page')
+    def test__get_status_summary(self, open_manager_page):
+        open_manager_page.side_effect = lambda page, *args, **kwargs: io.BytesIO({
+            'info': (
+                b'Cache information for squid:\n'
+                b'\tHits as % of all requests:\t5min: 80.4%, 60min: 75.0%\n'),
+            '5min': b'client_http.requests = 12.533333/sec\n'}[page])
+        self.assertEqual(
+            self.harness.charm._get_status_summary(), '12.5 req/s, 80% hit ratio')
+        open_manager_page.side_effect = ConnectionRefusedError('refused')
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(self.harness.charm._get_status_summary(), '')
+
     def test__get_ingress_config_proxy(self):
         self.assertEqual(
             self.harness.charm._get_ingress_config(),
             {
                 'service-hostname': 'squid-ingress-cache',
                 'service-name': 'squid-ingress-cache',
-                'service-port': 3128})
+                'service-port': 3128,
+                'upstream-hash-by': '$request_uri'})
         self.add_ingress_proxy_relation()
         self.assertEqual(
             self.harness.charm._get_ingress_config(),
@@ -120,7 +231,8 @@ class TestCharm(unittest.TestCase):
                 'service-hostname': 'mydomain.external.com',
                 'service-name': 'squid-ingress-cache',
                 'limit-rps': 12,
-                'service-port': 80})
+                'service-port': 80,
+                'upstream-hash-by': '$request_uri'})
 
     def test__get_ingress_config_cache(self):
         self.assertEqual(
@@ -128,7 +240,8 @@ class TestCharm(unittest.TestCase):
             {
                 'service-hostname': 'squid-ingress-cache',
                 'service-name': 'squid-ingress-cache',
-                'service-port': 3128})
+                'service-port': 3128,
+                'upstream-hash-by': '$request_uri'})
         self.add_ingress_cache_relation()
         self.assertEqual(
             self.harness.charm._get_ingress_config(),
@@ -136,7 +249,20 @@ class TestCharm(unittest.TestCase):
                 'service-hostname': 'mydomain.external.com',
                 'service-name': 'squid-ingress-cache',
                 'limit-rps': 12,
-                'service-port': 80})
+                'service-port': 80,
+                'upstream-hash-by': '$request_uri'})
+
+    def test__get_ingress_config_hash_by(self):
+        self.harness.set_leader(True)
+        rel_id = self.add_ingress_relation()
+        self.add_ingress_proxy_relation()
+        self._start_squid()
+        app_data = self.harness.get_relation_data(rel_id, 'squid-ingress-cache')
+        self.assertEqual(app_data['upstream-hash-by'], '$request_uri')
+        self.harness.update_config({'ingress_hash_by': '$host$request_uri'})
+        self.assertEqual(app_data['upstream-hash-by'], '$host$request_uri')
+        self.harness.update_config({'ingress_hash_by': ''})
+        self.assertNotIn('upstream-hash-by', app_data)
 
     def test__get_squid_config_proxy(self):
         self.add_ingress_proxy_relation()
@@ -175,3 +301,868 @@ class TestCharm(unittest.TestCase):
                         'options': [],
                         'percent': 0,
                         'regex': '(/cgi-bin/|\\?)'}]})
+
+    def test__get_squid_config_cache_sizing(self):
+        self.add_ingress_proxy_relation()
+        self.harness.update_config({
+            'cache_mem': '512 MB',
+            'maximum_object_size_in_memory': '1 MB',
+            'maximum_object_size': '64 MB',
+            'cache_dir_size': 2048})
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertIn('cache_mem 512 MB', squid_config)
+        self.assertIn('maximum_object_size_in_memory 1 MB', squid_config)
+        self.assertIn('maximum_object_size 64 MB', squid_config)
+        self.assertIn(
+            'cache_dir ufs /var/spool/squid 2048 16 256',
+            squid_config)
+
+    def test__get_squid_config_cache_sizing_relation(self):
+        self.harness.update_config({'cache_mem': '512 MB'})
+        self.add_ingress_proxy_relation(
+            cache_data=json.dumps({'cache-mem': '1024 MB'}))
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertIn('cache_mem 1024 MB', squid_config)
+        self.assertNotIn('cache_mem 512 MB', squid_config)
+
+    @patch('cgroup.get_memory_limit')
+    def test__get_squid_config_default_cache_mem(self, get_memory_limit):
+        self.add_ingress_proxy_relation()
+        get_memory_limit.return_value = 2 * 1024 * 1024 * 1024
+        self.assertIn(
+            'cache_mem 512 MB',
+            self.harness.charm._get_squid_config().splitlines())
+        # The shared memory cache has to fit in /dev/shm.
+        self.harness.update_config({'workers': 2})
+        self.assertIn(
+            'cache_mem 32 MB',
+            self.harness.charm._get_squid_config().splitlines())
+        self.harness.update_config({'workers': 1})
+        get_memory_limit.return_value = None
+        self.assertNotIn(
+            'cache_mem',
+            self.harness.charm._get_squid_config())
+
+    def test__get_squid_config_unused_storage(self):
+        self.add_ingress_proxy_relation()
+        self.harness.add_storage('cache')
+        with self.assertLogs(level='WARNING') as logger:
+            self.harness.charm._get_squid_config()
+        self.assertIn('cache_dir_size is not set', logger.output[0])
+
+    def test__get_squid_config_workers(self):
+        self.add_ingress_proxy_relation()
+        self.harness.update_config({
+            'workers': 4,
+            'cache_dir_size': 2048})
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertIn('workers 4', squid_config)
+        self.assertIn('memory_cache_shared on', squid_config)
+        self.assertIn('cache_dir rock /var/spool/squid 2048', squid_config)
+        self.assertEqual(
+            self.harness.charm._get_squid_command(),
+            '/usr/sbin/squid --foreground')
+
+    @patch('cgroup.get_cpu_limit')
+    def test__get_workers(self, get_cpu_limit):
+        get_cpu_limit.return_value = None
+        self.assertEqual(self.harness.charm._get_workers(), 1)
+        self.assertEqual(
+            self.harness.charm._get_squid_command(),
+            '/usr/sbin/squid -N')
+        # One worker per CPU is opt-in.
+        get_cpu_limit.return_value = 3.5
+        self.assertEqual(self.harness.charm._get_workers(), 1)
+        self.harness.update_config({'workers': 0})
+        get_cpu_limit.return_value = 0.5
+        self.assertEqual(self.harness.charm._get_workers(), 1)
+        get_cpu_limit.return_value = 3.5
+        self.assertEqual(self.harness.charm._get_workers(), 3)
+        self.harness.update_config({'workers': 2})
+        self.assertEqual(self.harness.charm._get_workers(), 2)
+
+    def test__configure_charm_workers_restart(self):
+        self.add_ingress_proxy_relation()
+        container = self._start_squid()
+        charm = self.harness.charm
+        restart_squid = charm._restart_squid
+        commands = []
+
+        def restart():
+            commands.append(container.get_plan().services['squid'].command)
+            restart_squid()
+
+        # Squid is restarted once, after the layer has its new command.
+        with patch.object(charm, '_restart_squid', side_effect=restart):
+            self.harness.update_config({'workers': 2})
+            self.assertEqual(commands, ['/usr/sbin/squid --foreground'])
+            self.assertTrue(container.get_service('squid').is_running())
+            self.harness.update_config({'workers': 1})
+            self.assertEqual(
+                commands,
+                ['/usr/sbin/squid --foreground', '/usr/sbin/squid -N'])
+
+    def _start_squid(self):
+        container = self.harness.model.unit.get_container("squid")
+        self.harness.charm.on.squid_pebble_ready.emit(container)
+        self.run_command.reset_mock()
+        return container
+
+    def test__render_config_reconfigure(self):
+        rel_id = self.add_ingress_proxy_relation()
+        container = self._start_squid()
+        with patch.object(self.harness.charm, '_restart_squid') as restart:
+            self.harness.add_relation_unit(rel_id, 'mywebsite/1')
+            restart.assert_not_called()
+        self.run_command.assert_any_call(
+            ['/usr/sbin/squid', '-k', 'parse', '-f', '/etc/squid/squid.conf.new'])
+        self.run_command.assert_called_with(
+            ['/usr/sbin/squid', '-k', 'reconfigure'])
+        self.assertIn(
+            'mywebsite-1.website-endpoints',
+            container.pull('/etc/squid/squid.conf').read())
+
+    def test__ingress_proxy_relation_changed_non_leader(self):
+        rel_id = self.add_ingress_proxy_relation()
+        self.harness.set_leader(False)
+        self.harness.update_config({'peer_address_mode': 'ip'})
+        container = self._start_squid()
+        self.harness.update_relation_data(
+            rel_id, 'mywebsite/0', {'ingress-address': '10.1.2.3'})
+        self.assertIn(
+            'cache_peer 10.1.2.3 ',
+            container.pull('/etc/squid/squid.conf').read())
+        # The website unit moved to a new pod address.
+        self.harness.update_relation_data(
+            rel_id, 'mywebsite/0', {'ingress-address': '10.1.2.4'})
+        squid_config = container.pull('/etc/squid/squid.conf').read()
+        self.assertIn('cache_peer 10.1.2.4 ', squid_config)
+        self.assertNotIn('10.1.2.3', squid_config)
+
+    def test__render_config_restart(self):
+        self.add_ingress_proxy_relation()
+        self._start_squid()
+        with patch.object(self.harness.charm, '_restart_squid') as restart:
+            self.harness.update_config({'cache_dir_size': 1024})
+            restart.assert_called_once_with()
+        self.assertNotIn(
+            unittest.mock.call(['/usr/sbin/squid', '-k', 'reconfigure']),
+            self.run_command.call_args_list)
+
+    def test__render_config_invalid(self):
+        self.add_ingress_proxy_relation()
+        container = self._start_squid()
+        existing_config = container.pull('/etc/squid/squid.conf').read()
+        self.run_command.return_value = False
+        self.harness.update_config({'cache_mem': 'lots'})
+        self.assertEqual(
+            container.pull('/etc/squid/squid.conf').read(),
+            existing_config)
+        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+
+    def test__configure_charm_unchanged(self):
+        self.add_ingress_proxy_relation()
+        self.harness.set_leader(True)
+        self.add_ingress_relation()
+        container = self._start_squid()
+        with patch.object(self.harness.charm, '_render_config') as render, \
+                patch.object(container, 'get_plan') as get_plan, \
+                patch.object(self.harness.charm.ingress, 'update_config') as update_config:
+            self.harness.charm.on.config_changed.emit()
+            render.assert_not_called()
+            get_plan.assert_not_called()
+            update_config.assert_not_called()
+            # A change to the config is still applied.
+            render.return_value = True
+            self.harness.update_config({'cache_mem': '512 MB'})
+            render.assert_called_once()
+            get_plan.assert_not_called()
+            update_config.assert_not_called()
+
+    def test__squid_pebble_ready_reapplies_config(self):
+        self.add_ingress_proxy_relation()
+        container = self._start_squid()
+        container.push('/etc/squid/squid.conf', '')
+        self._start_squid()
+        self.assertIn(
+            'mywebsite-0.website-endpoints',
+            container.pull('/etc/squid/squid.conf').read())
+
+    def test__initialise_cache_dir(self):
+        self.add_ingress_proxy_relation()
+        self.harness.update_config({'cache_dir_size': 1024})
+        container = self._start_squid()
+        self.assertEqual(
+            container.pull(
+                '/var/spool/squid/.squid-ingress-cache-init').read(),
+            'cache_dir ufs /var/spool/squid 1024 16 256')
+        # Already initialised for this cache_dir.
+        self.harness.charm._initialise_cache_dir()
+        self.run_command.assert_not_called()
+        self.harness.update_config({'cache_dir_size': 2048})
+        self.run_command.assert_any_call(
+            ['chown', 'proxy:proxy', '/var/spool/squid'])
+        self.run_command.assert_any_call(
+            ['/usr/sbin/squid', '-z', '-N', '-f', '/etc/squid/squid.conf'])
+        self.assertEqual(
+            container.pull(
+                '/var/spool/squid/.squid-ingress-cache-init').read(),
+            'cache_dir ufs /var/spool/squid 2048 16 256')
+
+    def test__initialise_cache_dir_no_cache_dir(self):
+        self.add_ingress_proxy_relation()
+        self._start_squid()
+        self.harness.charm._initialise_cache_dir()
+        self.run_command.assert_not_called()
+
+    def add_cluster_relation(self):
+        rel_id = self.harness.add_relation(
+            'cluster',
+            'squid-ingress-cache')
+        self.harness.add_relation_unit(
+            rel_id,
+            'squid-ingress-cache/1')
+        return rel_id
+
+    def test__get_siblings(self):
+        self.assertEqual(self.harness.charm._get_siblings(), [])
+        self.add_cluster_relation()
+        self.assertEqual(
+            self.harness.charm._get_siblings(),
+            ['squid-ingress-cache-1.squid-ingress-cache-endpoints.None.svc.cluster.local'])
+        self.harness.update_config({'sibling_cache': False})
+        self.assertEqual(self.harness.charm._get_siblings(), [])
+
+    def test__get_squid_config_siblings(self):
+        self.add_ingress_proxy_relation()
+        rel_id = self.add_cluster_relation()
+        sibling = 'squid-ingress-cache-1.squid-ingress-cache-endpoints.None.svc.cluster.local'
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertIn('http_port 3129 name=sibling', squid_config)
+        self.assertIn('digest_generation on', squid_config)
+        # Nothing may use the sibling port until the siblings' addresses
+        # are known, and siblings are only served hits.
+        start = squid_config.index('acl sibling_port myportname sibling')
+        self.assertEqual(squid_config[start + 1:start + 3], [
+            'http_access deny sibling_port',
+            'miss_access deny sibling_port'])
+        self.assertLess(start, squid_config.index('http_access allow localnet'))
+        self.harness.update_relation_data(
+            rel_id, 'squid-ingress-cache/1', {'ingress-address': '10.1.2.3'})
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertEqual(squid_config[start:start + 5], [
+            'acl sibling_port myportname sibling',
+            'acl siblings src 10.1.2.3',
+            'http_access allow sibling_port siblings',
+            'http_access deny sibling_port',
+            'miss_access deny sibling_port'])
+        self.assertIn(
+            f'cache_peer {sibling} sibling 3129 0 no-query proxy-only',
+            squid_config)
+        self.harness.update_config({'sibling_protocol': 'htcp'})
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertIn('htcp_port 4827', squid_config)
+        self.assertIn('htcp_access allow siblings', squid_config)
+        self.assertIn(
+            f'cache_peer {sibling} sibling 3129 4827 htcp proxy-only',
+            squid_config)
+
+    def test__get_squid_config_peer_options(self):
+        self.add_ingress_proxy_relation(
+            cache_data=json.dumps({'peer-connect-timeout': 2}))
+        self.harness.update_config({
+            'peer_selection': 'carp',
+            'peer_connect_fail_limit': 3,
+            'peer_connect_timeout': 5})
+        self.assertIn(
+            'cache_peer mywebsite-0.website-endpoints.None.svc.cluster.local '
+            'parent 80 0 no-query originserver carp connect-fail-limit=3 '
+            'connect-timeout=2',
+            self.harness.charm._get_squid_config().splitlines())
+        self.harness.update_config({'peer_selection': 'random'})
+        self.assertIn(
+            'cache_peer mywebsite-0.website-endpoints.None.svc.cluster.local '
+            'parent 80 0 no-query originserver connect-fail-limit=3 '
+            'connect-timeout=2',
+            self.harness.charm._get_squid_config().splitlines())
+
+    def test__get_squid_config_retry_errors(self):
+        rel_id = self.add_ingress_proxy_relation()
+        self.assertNotIn(
+            'forward_max_tries',
+            self.harness.charm._get_squid_config())
+        self.harness.add_relation_unit(rel_id, 'mywebsite/1')
+        self.harness.update_relation_data(
+            rel_id,
+            'mywebsite',
+            {'retry-errors': 'error,timeout'})
+        squid_config = self.harness.charm._get_squid_config()
+        # Squid's default of 25 tries already covers both units.
+        self.assertNotIn('forward_max_tries', squid_config)
+        self.assertNotIn('retry_on_error on', squid_config)
+        for unit in range(2, 30):
+            self.harness.add_relation_unit(rel_id, f'mywebsite/{unit}')
+        self.assertIn(
+            'forward_max_tries 30',
+            self.harness.charm._get_squid_config().splitlines())
+        self.harness.update_relation_data(
+            rel_id,
+            'mywebsite',
+            {'retry-errors': 'error,timeout,http_502,http_503'})
+        self.assertIn(
+            'retry_on_error on',
+            self.harness.charm._get_squid_config().splitlines())
+
+    def add_website_relation(self, app_name, relation_data):
+        rel_id = self.harness.add_relation('ingress-proxy', app_name)
+        self.harness.add_relation_unit(rel_id, f'{app_name}/0')
+        self.harness.update_relation_data(rel_id, app_name, relation_data)
+        return rel_id
+
+    def test__get_squid_config_multiple_websites(self):
+        self.add_ingress_cache_relation()
+        self.add_website_relation('blog', {
+            'service-hostname': 'mydomain.external.com',
+            'service-name': 'blog',
+            'service-port': 8080,
+            'path-routes': '/blog,/feed.xml',
+            'cache-settings': json.dumps({
+                'cache-mem': '1 GB',
+                'refresh-patterns': [{
+                    'case_sensitive': False,
+                    'regex': '\\.xml$',
+                    'min': 10,
+                    'percent': 20,
+                    'max': 60,
+                    'options': []}]})})
+        self.add_website_relation('shop', {
+            'service-hostname': 'shop.external.com',
+            'service-name': 'shop'})
+        self.add_website_relation('docs', {
+            'service-hostname': 'docs.external.com',
+            'service-name': 'docs',
+            'service-port': 80})
+        squid_config = self.harness.charm._get_squid_config()
+        self.assertIn(
+            'http_port 80 accel\n'
+            'http_port 8080 accel\n'
+            'never_direct allow all\n'
+            'acl mywebsite_host dstdomain mydomain.external.com\n'
+            'acl blog_host dstdomain mydomain.external.com\n'
+            'acl blog_path urlpath_regex ^/blog ^/feed\\.xml\n'
+            'acl docs_host dstdomain docs.external.com\n'
+            'cache_peer mywebsite-0.website-endpoints.None.svc.cluster.local '
+            'parent 80 0 no-query originserver name=mywebsite_0\n'
+            'cache_peer_access mywebsite_0 deny mywebsite_host blog_path\n'
+            'cache_peer_access mywebsite_0 allow mywebsite_host\n'
+            'cache_peer_access mywebsite_0 deny all\n'
+            'cache_peer blog-0.blog-endpoints.None.svc.cluster.local '
+            'parent 8080 0 no-query originserver name=blog_0\n'
+            'cache_peer_access blog_0 allow blog_host blog_path\n'
+            'cache_peer_access blog_0 deny all\n'
+            'cache_peer docs-0.docs-endpoints.None.svc.cluster.local '
+            'parent 80 0 no-query originserver name=docs_0\n',
+            squid_config)
+        # Incomplete website relations are not routed to.
+        self.assertNotIn('shop', squid_config)
+        # Refresh patterns from all websites are kept.
+        self.assertIn('refresh_pattern \\.xml$ 10 20% 60', squid_config)
+        self.assertIn('refresh_pattern ^ftp:', squid_config)
+        self.assertIn('cache_mem 1 GB', squid_config.splitlines())
+        # The first website is published on the ingress relation.
+        self.assertEqual(
+            self.harness.charm._get_ingress_config()['service-hostname'],
+            'mydomain.external.com')
+
+    def test__get_squid_config_origin_tls(self):
+        self.add_ingress_proxy_relation()
+        self.harness.update_config({
+            'origin_tls': True,
+            'origin_tls_verify': False})
+        self.assertIn(
+            'cache_peer mywebsite-0.website-endpoints.None.svc.cluster.local '
+            'parent 80 0 no-query originserver tls tls-flags=DONT_VERIFY_PEER',
+            self.harness.charm._get_squid_config().splitlines())
+
+    def test__get_squid_config_store_id(self):
+        self.add_ingress_proxy_relation()
+        self.assertNotIn(
+            'store_id_program',
+            self.harness.charm._get_squid_config())
+        self.harness.update_config({
+            'store_id_strip_params': 'utm_*, fbclid',
+            'store_id_sort_query': True})
+        self.assertIn(
+            'store_id_program /usr/bin/python3 /usr/local/bin/squid_store_id.py '
+            '--strip-params utm_* fbclid --sort-query',
+            self.harness.charm._get_squid_config().splitlines())
+
+    def test__get_squid_config_store_id_relation(self):
+        self.add_ingress_proxy_relation(
+            cache_data=json.dumps({'store-id-strip-params': ['gclid']}))
+        container = self._start_squid()
+        self.assertIn(
+            'store_id_program /usr/bin/python3 /usr/local/bin/squid_store_id.py '
+            '--strip-params gclid',
+            container.pull('/etc/squid/squid.conf').read().splitlines())
+        self.assertTrue(
+            container.pull('/usr/local/bin/squid_store_id.py').read())
+
+    def test__get_squid_config_cache_profile(self):
+        self.add_ingress_proxy_relation(
+            cache_data=json.dumps({'cache-replacement-policy': 'heap GDSF'}))
+        self.harness.update_config({
+            'cache_profile': 'large-media',
+            'cache_dir_size': 2048,
+            'maximum_object_size': '4 GB'})
+        squid_config = self.harness.charm._get_squid_config()
+        self.assertIn(
+            'memory_replacement_policy heap GDSF\n'
+            'cache_replacement_policy heap GDSF\n'
+            'cache_dir ufs /var/spool/squid 2048 16 256 min-size=1048576\n'
+            'range_offset_limit -1\n'
+            'quick_abort_min -1 KB\n',
+            squid_config)
+        self.assertIn('maximum_object_size_in_memory 1 MB', squid_config)
+        self.assertIn('maximum_object_size 4 GB', squid_config)
+
+    def test__get_squid_config_cache_profile_unknown(self):
+        self.add_ingress_proxy_relation()
+        self.harness.update_config({'cache_profile': 'everything'})
+        self.assertNotIn(
+            'replacement_policy',
+            self.harness.charm._get_squid_config())
+
+    @patch('warmup.warm')
+    def test__warm_cache_action(self, warm):
+        event = Mock(params={
+            'urls': '/a.html /b.html',
+            'concurrency': 2,
+            'timeout': 30})
+        self.harness.charm._warm_cache_action(event)
+        event.fail.assert_called_once_with(
+            'Ingress proxy relation missing or incomplete')
+        self.add_ingress_proxy_relation()
+        warm.return_value = [
+            {'url': '/a.html', 'status': 200, 'bytes': 10,
+             'result': 'TCP_HIT', 'time': 0.1},
+            {'url': '/b.html', 'status': None, 'bytes': 0,
+             'result': 'NONE', 'time': 0.1, 'error': 'timed out'}]
+        event = Mock(params={
+            'urls': '/a.html /b.html',
+            'concurrency': 2,
+            'timeout': 30})
+        self.harness.charm._warm_cache_action(event)
+        warm.assert_called_once_with(
+            ['/a.html', '/b.html'], 80, 'mydomain.external.com', 2, 30)
+        results = event.set_results.call_args[0][0]
+        self.assertEqual(results['urls'], 2)
+        self.assertEqual(results['bytes'], 10)
+        self.assertEqual(
+            json.loads(results['summary']),
+            {'TCP_HIT': 1, 'error': 1})
+
+    def test__warm_cache_action_no_urls(self):
+        self.add_ingress_proxy_relation()
+        event = Mock(params={'concurrency': 2, 'timeout': 30})
+        self.harness.charm._warm_cache_action(event)
+        event.fail.assert_called_once_with(
+            'No URLs given, set urls or sitemap')
+
+    @patch('purge.purge')
+    @patch('purge.list_cached_urls')
+    def test__purge_action(self, list_cached_urls, purge):
+        self.add_ingress_proxy_relation()
+        rel_id = self.add_cluster_relation()
+        list_cached_urls.return_value = iter([
+            'http://mydomain.external.com/images/a.png',
+            'http://mydomain.external.com/index.html'])
+        purge.return_value = [
+            {'url': '/index.html', 'status': 200},
+            {'url': 'http://mydomain.external.com/images/a.png',
+             'status': 200}]
+        event = Mock(params={
+            'urls': '/index.html',
+            'prefixes': 'http://mydomain.external.com/images/',
+            'all-units': True})
+        self.harness.charm._purge_action(event)
+        purge.assert_called_once_with(
+            ['/index.html', 'http://mydomain.external.com/images/a.png'],
+            80,
+            'mydomain.external.com')
+        self.assertEqual(event.set_results.call_args[0][0]['purged'], 2)
+        purge_request = json.loads(self.harness.get_relation_data(
+            rel_id,
+            'squid-ingress-cache/0')['purge-request'])
+        self.assertEqual(purge_request['urls'], ['/index.html'])
+        self.assertEqual(
+            purge_request['prefixes'],
+            ['http://mydomain.external.com/images/'])
+
+    @patch('purge.purge')
+    @patch('purge.list_cached_urls')
+    def test__purge_action_unlisted(self, list_cached_urls, purge):
+        self.add_ingress_proxy_relation()
+
+        def list_urls(port, counts):
+            counts.update({'objects': 2, 'unlisted': 1})
+            return iter(['http://mydomain.external.com/images/a.png'])
+
+        list_cached_urls.side_effect = list_urls
+        purge.return_value = []
+        log_lines = [
+            '10.0.0.1 - - [18/Oct/2021:10:00:00 +0000] "GET '
+            'http://mydomain.external.com/images/a.png HTTP/1.1" 200 512 '
+            '"-" "curl" TCP_MISS:HIER_DIRECT\n',
+            '10.0.0.1 - - [18/Oct/2021:10:00:01 +0000] "GET '
+            'http://mydomain.external.com/images/b.png HTTP/1.1" 200 512 '
+            '"-" "curl" TCP_MISS:HIER_DIRECT\n']
+        event = Mock(params={'prefixes': 'http://mydomain.external.com/images/'})
+        with patch.object(self.harness.charm, '_stream_log') as stream_log:
+            stream_log.side_effect = lambda log_file, consume: consume(log_lines)
+            self.harness.charm._purge_action(event)
+        stream_log.assert_called_once_with('/var/log/squid/access.log', ANY)
+        purge.assert_called_once_with(
+            ['http://mydomain.external.com/images/a.png',
+             'http://mydomain.external.com/images/b.png'],
+            80,
+            'mydomain.external.com')
+        results = event.set_results.call_args[0][0]
+        self.assertEqual(results['unlisted-objects'], 1)
+        self.assertEqual(results['urls-from-access-log'], 1)
+
+    def test__purge_action_invalid(self):
+        self.add_ingress_proxy_relation()
+        event = Mock(params={})
+        self.harness.charm._purge_action(event)
+        event.fail.assert_called_once_with(
+            'Nothing to purge, set urls, prefixes or regexes')
+        event = Mock(params={'regexes': '('})
+        with patch('purge.list_cached_urls') as list_cached_urls:
+            list_cached_urls.return_value = iter([])
+            self.harness.charm._purge_action(event)
+        self.assertTrue(
+            event.fail.call_args[0][0].startswith('Invalid regex'))
+
+    @patch('purge.purge')
+    def test__cluster_relation_changed_purge(self, purge):
+        self.add_ingress_proxy_relation()
+        self._start_squid()
+        rel_id = self.add_cluster_relation()
+        purge_request = json.dumps({
+            'id': '1',
+            'urls': ['/index.html'],
+            'prefixes': [],
+            'regexes': []})
+        self.harness.update_relation_data(
+            rel_id,
+            'squid-ingress-cache/1',
+            {'purge-request': purge_request})
+        purge.assert_called_once_with(
+            ['/index.html'], 80, 'mydomain.external.com')
+        # The same request is only handled once.
+        self.harness.update_relation_data(
+            rel_id,
+            'squid-ingress-cache/1',
+            {'other': 'data'})
+        purge.assert_called_once_with(
+            ['/index.html'], 80, 'mydomain.external.com')
+
+    def test__metrics_endpoint_relation(self):
+        self.add_ingress_proxy_relation()
+        container = self._start_squid()
+        self.harness.set_leader(True)
+        rel_id = self.harness.add_relation('metrics-endpoint', 'prometheus')
+        self.harness.add_relation_unit(rel_id, 'prometheus/0')
+        app_data = self.harness.get_relation_data(rel_id, 'squid-ingress-cache')
+        self.assertEqual(
+            json.loads(app_data['scrape_jobs']),
+            [{
+                'metrics_path': '/metrics',
+                'static_configs': [{'targets': ['*:9301']}]}])
+        unit_data = self.harness.get_relation_data(
+            rel_id,
+            'squid-ingress-cache/0')
+        self.assertEqual(
+            unit_data['prometheus_scrape_unit_address'],
+            'squid-ingress-cache-0.squid-ingress-cache-endpoints.None.svc.cluster.local')
+        plan = self.harness.get_container_pebble_plan("squid").to_dict()
+        self.assertEqual(
+            plan['services']['squid-exporter']['command'],
+            'python3 /usr/local/bin/squid_metrics.py --port 9301 --manager-port 3130')
+        self.assertEqual(
+            plan['services']['squid-exporter']['startup'],
+            'enabled')
+        self.assertTrue(
+            container.pull('/usr/local/bin/squid_metrics.py').read())
+        self.assertTrue(container.get_service('squid-exporter').is_running())
+        self.harness.remove_relation(rel_id)
+        plan = self.harness.get_container_pebble_plan("squid").to_dict()
+        self.assertEqual(
+            plan['services']['squid-exporter']['startup'],
+            'disabled')
+        self.assertFalse(container.get_service('squid-exporter').is_running())
+
+    def test__analyse_access_log_action(self):
+        line = (
+            '10.1.1.1 - - [11/Jun/2021:14:20:34 +0000] '
+            '"GET http://mydomain.com/a.png HTTP/1.1" 200 100 "-" "curl" '
+            'TCP_MISS:HIER_DIRECT/10.1.1.2\n')
+        process = Mock(stdout=iter([line, line]))
+        event = Mock(params={'top': 5, 'min-requests': 1})
+        with patch('ops.model.Container.exec') as container_exec:
+            container_exec.return_value = process
+            self.harness.charm._analyse_access_log_action(event)
+            container_exec.assert_called_once_with(
+                ['cat', '/var/log/squid/access.log'],
+                encoding='utf-8')
+        results = event.set_results.call_args[0][0]
+        self.assertEqual(results['lines'], 2)
+        self.assertEqual(
+            json.loads(results['most-missed']),
+            [['http://mydomain.com/a.png', 2]])
+        self.assertEqual(
+            json.loads(results['suggested-refresh-patterns'])[0]['regex'],
+            '\\.png$')
+
+    def test__get_squid_config_access_log_mode(self):
+        self.add_ingress_proxy_relation()
+        self.harness.update_config({'access_log_mode': 'off'})
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertIn('access_log none', squid_config)
+        # Turning the log off does not depend on the log format.
+        self.harness.update_config({'log_format': ''})
+        squid_config = self.harness.charm._get_squid_config()
+        self.assertIn('access_log none', squid_config.splitlines())
+        self.assertNotIn('logformat', squid_config)
+        self.harness.update_config(unset=['log_format'])
+        self.harness.update_config({'access_log_mode': 'buffered'})
+        self.assertIn(
+            'access_log daemon:/var/log/squid/access.log logformat=combined '
+            'on-error=drop buffer-size=1MB',
+            self.harness.charm._get_squid_config().splitlines())
+        self.harness.update_config({
+            'access_log_mode': 'stdio',
+            'access_log_buffer_size': '64 KB'})
+        self.assertIn(
+            'access_log stdio:/dev/stdout logformat=combined buffer-size=64KB',
+            self.harness.charm._get_squid_config().splitlines())
+
+    def test__get_squid_config_access_log_sampled(self):
+        self.add_ingress_proxy_relation()
+        self.harness.update_config({
+            'access_log_mode': 'sampled',
+            'access_log_sample_rate': 10,
+            'access_log_misses_only': True})
+        self.assertIn(
+            'acl access_log_sample random 1/10\n'
+            'acl access_log_hit hier_code HIER_NONE\n'
+            'access_log daemon:/var/log/squid/access.log logformat=combined '
+            'access_log_sample !access_log_hit\n',
+            self.harness.charm._get_squid_config())
+
+    def test__optimise_refresh_patterns_action(self):
+        self.add_ingress_proxy_relation(cache_data=json.dumps({
+            'refresh-patterns': [
+                {'case_sensitive': False, 'regex': '\\.png$', 'min': 0,
+                 'percent': 20, 'max': 60, 'options': []},
+                {'case_sensitive': False, 'regex': '\\.css$', 'min': 0,
+                 'percent': 20, 'max': 60, 'options': []},
+                {'case_sensitive': False, 'regex': '/a\\.png$', 'min': 0,
+                 'percent': 20, 'max': 60, 'options': []}]}))
+        container = self._start_squid()
+        squid_config = container.pull('/etc/squid/squid.conf').read()
+        self.assertIn(
+            'refresh_pattern \\.png$ 0 20% 60 \n'
+            'refresh_pattern \\.css$ 0 20% 60 \n'
+            'refresh_pattern . 0 20% 4320\n',
+            squid_config)
+        line = (
+            '10.1.1.1 - - [11/Jun/2021:14:20:34 +0000] '
+            '"GET http://mydomain.com/a.css HTTP/1.1" 200 100 "-" "curl" '
+            'TCP_MISS:HIER_DIRECT/10.1.1.2\n')
+        process = Mock(stdout=iter([line, line]))
+        event = Mock(params={'count': True})
+        with patch('ops.model.Container.exec') as container_exec:
+            container_exec.return_value = process
+            self.harness.charm._optimise_refresh_patterns_action(event)
+        results = event.set_results.call_args[0][0]
+        self.assertEqual(
+            json.loads(results['shadowed']),
+            [{'regex': '/a\\.png$', 'by': '\\.png$'}])
+        self.assertEqual(
+            json.loads(results['counts']),
+            {'\\.png$': 0, '\\.css$': 2})
+        self.assertEqual(
+            json.loads(results['refresh-patterns']),
+            ['\\.css$', '\\.png$'])
+        self.assertIn(
+            'refresh_pattern \\.css$ 0 20% 60 \n'
+            'refresh_pattern \\.png$ 0 20% 60 \n',
+            container.pull('/etc/squid/squid.conf').read())
+
+    def test__simulate_cache_action(self):
+        line = (
+            '10.1.1.1 - - [11/Jun/2021:14:20:34 +0000] '
+            '"GET http://mydomain.com/a.png HTTP/1.1" 200 100 "-" "curl" '
+            'TCP_MISS:HIER_DIRECT/10.1.1.2\n')
+        process = Mock(stdout=iter([line, line]))
+        event = Mock(params={'sizes': '1 KB', 'policies': 'lru,gdsf'})
+        with patch('ops.model.Container.exec') as container_exec:
+            container_exec.return_value = process
+            self.harness.charm._simulate_cache_action(event)
+        results = event.set_results.call_args[0][0]
+        self.assertEqual(results['requests'], 2)
+        self.assertEqual(
+            json.loads(results['results']),
+            [
+                {'size': '1 KB', 'policy': 'lru', 'hit-ratio': 0.5, 'byte-hit-ratio': 0.5},
+                {'size': '1 KB', 'policy': 'gdsf', 'hit-ratio': 0.5, 'byte-hit-ratio': 0.5}])
+
+    def test__simulate_cache_action_invalid(self):
+        event = Mock(params={'sizes': 'lots', 'policies': 'lru'})
+        self.harness.charm._simulate_cache_action(event)
+        event.fail.assert_called_once_with("Invalid parameters: invalid size 'lots'")
+
+    def test__get_squid_config_stampede_protection(self):
+        self.add_ingress_proxy_relation(
+            cache_data=json.dumps({'max-stale': '1 day'}))
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertNotIn('collapsed_forwarding on', squid_config)
+        self.assertIn('max_stale 1 day', squid_config)
+        self.harness.update_config({
+            'collapsed_forwarding': True,
+            'max_stale': '1 hour'})
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertIn('collapsed_forwarding on', squid_config)
+        self.assertIn('max_stale 1 day', squid_config)
+
+    def test__get_squid_config_persistent_connections(self):
+        rel_id = self.add_ingress_proxy_relation(
+            cache_data=json.dumps({'peer-standby': 20}))
+        self.harness.add_relation_unit(rel_id, 'mywebsite/1')
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertNotIn('server_persistent_connections off', squid_config)
+        self.assertEqual(
+            [line for line in squid_config if line.startswith('cache_peer')],
+            [
+                'cache_peer mywebsite-0.website-endpoints.None.svc.cluster.local '
+                'parent 80 0 no-query originserver standby=20',
+                'cache_peer mywebsite-1.website-endpoints.None.svc.cluster.local '
+                'parent 80 0 no-query originserver standby=20'])
+        self.harness.update_config({
+            'server_persistent_connections': False,
+            'client_persistent_connections': False,
+            'server_idle_pconn_timeout': '2 minutes',
+            'client_idle_pconn_timeout': '30 seconds'})
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertIn('server_persistent_connections off', squid_config)
+        self.assertIn('client_persistent_connections off', squid_config)
+        self.assertIn('server_idle_pconn_timeout 2 minutes', squid_config)
+        self.assertIn('client_idle_pconn_timeout 30 seconds', squid_config)
+
+    def test__get_squid_config_dns(self):
+        self.add_ingress_proxy_relation()
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertIn('dns_defnames off', squid_config)
+        for directive in ('dns_v4_first', 'ipcache_size', 'positive_dns_ttl',
+                          'negative_dns_ttl'):
+            self.assertNotIn(directive, '\n'.join(squid_config))
+        self.harness.update_config({
+            'dns_ipcache_size': 4096,
+            'dns_positive_ttl': '6 hours',
+            'dns_negative_ttl': '5 minutes',
+            'dns_v4_first': True})
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertIn('dns_v4_first on', squid_config)
+        self.assertIn('ipcache_size 4096', squid_config)
+        self.assertIn('positive_dns_ttl 6 hours', squid_config)
+        self.assertIn('negative_dns_ttl 5 minutes', squid_config)
+
+    def test__get_squid_config_origin_max_connections(self):
+        self.add_ingress_proxy_relation()
+        # The website's limit-rps is a per client rate for nginx, not a cap.
+        squid_config = self.harness.charm._get_squid_config()
+        self.assertNotIn('max-conn', squid_config)
+        self.assertNotIn('never_direct', squid_config)
+        self.harness.update_config({'origin_max_connections': 4})
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertIn('never_direct allow all', squid_config)
+        self.assertIn(
+            'cache_peer mywebsite-0.website-endpoints.None.svc.cluster.local '
+            'parent 80 0 no-query originserver max-conn=4',
+            squid_config)
+
+    def test__get_squid_config_origin_max_bytes_per_second(self):
+        self.add_website_relation('mywebsite', {
+            'service-hostname': 'mydomain.external.com',
+            'service-name': 'website',
+            'service-port': 80,
+            'limit-whitelist': '10.0.0.0/8,192.168.0.1'})
+        squid_config = self.harness.charm._get_squid_config()
+        self.assertNotIn('never_direct', squid_config)
+        self.assertNotIn('max-conn', squid_config)
+        self.assertNotIn('delay_pools', squid_config)
+        self.harness.update_config({
+            'origin_max_bytes_per_second': 1048576,
+            'origin_limit_whitelist': '172.16.0.0/12'})
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        start = squid_config.index('delay_pools 1')
+        self.assertEqual(squid_config[start - 1:start + 6], [
+            'acl origin_limit_exempt src 10.0.0.0/8 172.16.0.0/12 192.168.0.1',
+            'delay_pools 1',
+            'delay_class 1 1',
+            'delay_parameters 1 1048576/1048576',
+            'delay_access 1 deny origin_limit_exempt',
+            'delay_access 1 allow all',
+            'delay_access 1 deny all'])
+
+    def test__get_squid_config_origin_max_bytes_per_second_routing(self):
+        self.add_website_relation('blog', {
+            'service-hostname': 'blog.external.com',
+            'service-name': 'blog',
+            'service-port': 80})
+        self.add_website_relation('shop', {
+            'service-hostname': 'shop.external.com',
+            'service-name': 'shop',
+            'service-port': 80})
+        self.harness.update_config({'origin_max_bytes_per_second': 65536})
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        self.assertNotIn('acl origin_limit_exempt', '\n'.join(squid_config))
+        start = squid_config.index('delay_pools 2')
+        self.assertEqual(squid_config[start:start + 9], [
+            'delay_pools 2',
+            'delay_class 1 1',
+            'delay_parameters 1 65536/65536',
+            'delay_access 1 allow blog_host',
+            'delay_access 1 deny all',
+            'delay_class 2 1',
+            'delay_parameters 2 65536/65536',
+            'delay_access 2 allow shop_host',
+            'delay_access 2 deny all'])
+
+    def test__get_squid_config_origin_max_bytes_per_second_paths(self):
+        self.add_website_relation('blog', {
+            'service-hostname': 'a.external.com',
+            'service-name': 'blog',
+            'service-port': 80})
+        self.add_website_relation('shop', {
+            'service-hostname': 'a.external.com',
+            'service-name': 'shop',
+            'service-port': 80,
+            'path-routes': '/shop'})
+        self.harness.update_config({'origin_max_bytes_per_second': 65536})
+        squid_config = self.harness.charm._get_squid_config().splitlines()
+        start = squid_config.index('delay_pools 2')
+        # The shop's misses only count against the shop's pool.
+        self.assertEqual(squid_config[start:start + 10], [
+            'delay_pools 2',
+            'delay_class 1 1',
+            'delay_parameters 1 65536/65536',
+            'delay_access 1 deny blog_host shop_path',
+            'delay_access 1 allow blog_host',
+            'delay_access 1 deny all',
+            'delay_class 2 1',
+            'delay_parameters 2 65536/65536',
+            'delay_access 2 allow shop_host shop_path',
+            'delay_access 2 deny all'])
@@ -19,17 +19,23 @@ acl Safe_ports port 488		# gss-http
 acl Safe_ports port 591		# filemaker
 acl Safe_ports port 777		# multiling http
 acl CONNECT method CONNECT
+acl PURGE method PURGE
 http_access deny !Safe_ports
 http_access deny CONNECT !SSL_ports
 http_access allow localhost manager
 http_access deny manager
+http_access allow localhost PURGE
+http_access deny PURGE
 include /etc/squid/conf.d/*
 http_access allow localhost
 http_access allow localnet
 http_access deny all
 coredump_dir /var/spool/squid
+http_port 127.0.0.1:3130
 logformat combined %>a %ui %un [%tl] "%rm %ru HTTP/%rv" %>Hs %<st "%{Referer}>h" "%{User-Agent}>h" %Ss:%Sh
+access_log daemon:/var/log/squid/access.log logformat=combined
 refresh_pattern . 0 20% 4320
+dns_defnames off
 
 http_port 80 accel
 cache_peer mywebsite-0.website-endpoints.None.svc.cluster.local parent 80 0 no-query originserver
@@ -56,19 +62,25 @@ acl Safe_ports port 488		# gss-http
 acl Safe_ports port 591		# filemaker
 acl Safe_ports port 777		# multiling http
 acl CONNECT method CONNECT
+acl PURGE method PURGE
 http_access deny !Safe_ports
 http_access deny CONNECT !SSL_ports
 http_access allow localhost manager
 http_access deny manager
+http_access allow localhost PURGE
+http_access deny PURGE
 include /etc/squid/conf.d/*
 http_access allow localhost
 http_access allow localnet
 http_access deny all
 coredump_dir /var/spool/squid
+http_port 127.0.0.1:3130
 logformat combined %>a %ui %un [%tl] "%rm %ru HTTP/%rv" %>Hs %<st "%{Referer}>h" "%{User-Agent}>h" %Ss:%Sh
+access_log daemon:/var/log/squid/access.log logformat=combined
 refresh_pattern ^ftp: 1440 20% 10080 override-expire
 refresh_pattern -i (/cgi-bin/|\?) 0 0% 0 
 refresh_pattern . 0 20% 4320
+dns_defnames off
 
 http_port 80 accel
 cache_peer mywebsite-0.website-endpoints.None.svc.cluster.local parent 80 0 no-query originserver
@@ -0,0 +1,82 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+import unittest
+
+import log_analysis
+
+LOG_FORMAT = (
+    '%>a %ui %un [%tl] "%rm %ru HTTP/%rv" %>Hs %<st "%{Referer}>h" '
+    '"%{User-Agent}>h" %Ss:%Sh')
+
+
+def log_line(url, result, status=200, size=100):
+    return (
+        f'10.1.1.1 - - [11/Jun/2021:14:20:34 +0000] "GET {url} HTTP/1.1" '
+        f'{status} {size} "-" "Mozilla/5.0 (X11; Linux x86_64)" '
+        f'{result}:HIER_NONE/-\n')
+
+
+class TestLogAnalysis(unittest.TestCase):
+
+    def test_logformat_regex(self):
+        regex = log_analysis.logformat_regex(LOG_FORMAT)
+        match = regex.match(log_line(
+            'http://mydomain.com/images/a.png',
+            'TCP_MEM_HIT').rstrip('\n'))
+        self.assertEqual(match.group('url'), 'http://mydomain.com/images/a.png')
+        self.assertEqual(match.group('result'), 'TCP_MEM_HIT')
+        self.assertEqual(match.group('status'), '200')
+        self.assertEqual(match.group('method'), 'GET')
+
+    def test_classify(self):
+        self.assertEqual(log_analysis.classify('TCP_MEM_HIT'), 'hit')
+        self.assertEqual(
+            log_analysis.classify('TCP_REFRESH_UNMODIFIED'),
+            'revalidate')
+        self.assertEqual(log_analysis.classify('TCP_MISS'), 'miss')
+        self.assertEqual(log_analysis.classify('TCP_DENIED'), 'other')
+
+    def test_heavy_hitters(self):
+        counter = log_analysis.HeavyHitters(3)
+        for key in ['a'] * 10 + ['b'] * 5 + list('cdefgh'):
+            counter.add(key)
+        self.assertLessEqual(len(counter.counts), 3)
+        self.assertEqual([k for k, _ in counter.top(2)], ['a', 'b'])
+
+    def test_report(self):
+        analyser = log_analysis.AccessLogAnalyser(LOG_FORMAT)
+        analyser.add_lines(
+            [log_line('http://mydomain.com/images/a.png', 'TCP_REFRESH_UNMODIFIED')] * 60)
+        analyser.add_lines(
+            [log_line('http://mydomain.com/images/b.png', 'TCP_HIT')] * 40)
+        analyser.add_lines(
+            [log_line('http://mydomain.com/index.html', 'TCP_MISS')] * 10)
+        analyser.add_line('garbage\n')
+        report = analyser.report(top=5, min_requests=50)
+        self.assertEqual(report['lines'], 111)
+        self.assertEqual(report['unparsed'], 1)
+        self.assertEqual(report['totals']['requests'], 110)
+        self.assertEqual(
+            report['patterns']['mydomain.com/images/*.png'],
+            {'requests': 100, 'hit': 0.4, 'revalidate': 0.6, 'miss': 0})
+        self.assertEqual(report['content-types']['.html']['miss'], 1)
+        self.assertEqual(
+            report['most-missed'],
+            [('http://mydomain.com/index.html', 10)])
+        self.assertEqual(
+            report['most-revalidated'],
+            [('http://mydomain.com/images/a.png', 60)])
+        self.assertEqual(
+            report['suggested-refresh-patterns'],
+            [{
+                'regex': '\\.png$',
+                'case_sensitive': True,
+                'min': 1440,
+                'percent': 50,
+                'max': 10080,
+                'options': []}])
+
+    def test_log_format_without_result(self):
+        with self.assertRaises(ValueError):
+            log_analysis.AccessLogAnalyser('%>a %ru')
@@ -0,0 +1,116 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+import http.server
+import re
+import threading
+import unittest
+
+import purge
+
+OBJECTS_PAGE = b"""KEY 5A3C6A5A8F1D3B2A9C7E6F5D4C3B2A19
+\tSTORE_OK      IN_MEMORY     SWAPOUT_NONE PING_NONE
+\t0 locks, 0 clients, 1 refs
+\tGET http://mydomain.external.com/images/a.png
+KEY 6A3C6A5A8F1D3B2A9C7E6F5D4C3B2A19
+\tSTORE_OK      IN_MEMORY     SWAPOUT_NONE PING_NONE
+\tHEAD http://mydomain.external.com/images/a.png
+KEY 7A3C6A5A8F1D3B2A9C7E6F5D4C3B2A19
+\tGET http://mydomain.external.com/index.html
+KEY 9A3C6A5A8F1D3B2A9C7E6F5D4C3B2A19
+\tSTORE_OK      NOT_IN_MEMORY SWAPOUT_DONE PING_NONE
+KEY 8A3C6A5A8F1D3B2A9C7E6F5D4C3B2A19
+\tGET http://mydomain.external.com/css/site.css?v=2
+KEY AA3C6A5A8F1D3B2A9C7E6F5D4C3B2A19
+\tSTORE_OK      NOT_IN_MEMORY SWAPOUT_DONE PING_NONE
+"""
+
+
+class FakeSquidHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/squid-internal-mgr/objects':
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(OBJECTS_PAGE)
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def do_PURGE(self):
+        self.server.purged.append((self.headers['Host'], self.path))
+        self.send_response(200 if self.path != '/missing' else 404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPurge(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), FakeSquidHandler)
+        self.server.purged = []
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_list_cached_urls(self):
+        counts = {}
+        self.assertEqual(
+            list(purge.list_cached_urls(self.port, counts=counts)),
+            [
+                'http://mydomain.external.com/images/a.png',
+                'http://mydomain.external.com/images/a.png',
+                'http://mydomain.external.com/index.html',
+                'http://mydomain.external.com/css/site.css?v=2'])
+        # Objects only on disk are listed without their URL.
+        self.assertEqual(counts, {'objects': 6, 'unlisted': 2})
+
+    def test_logged_urls(self):
+        lines = [
+            '10.0.0.1 - - [18/Oct/2021:10:00:00 +0000] "GET '
+            'http://mydomain.external.com/images/b.png HTTP/1.1" 200 512 '
+            '"-" "curl" TCP_HIT:HIER_NONE\n',
+            'garbage\n']
+        self.assertEqual(
+            list(purge.logged_urls(
+                lines,
+                '%>a %ui %un [%tl] "%rm %ru HTTP/%rv" %>Hs %<st '
+                '"%{Referer}>h" "%{User-Agent}>h" %Ss:%Sh')),
+            ['http://mydomain.external.com/images/b.png'])
+        with self.assertRaises(ValueError):
+            list(purge.logged_urls(lines, '%>a %Ss'))
+
+    def test_select_urls(self):
+        cached_urls = purge.list_cached_urls(self.port)
+        self.assertEqual(
+            purge.select_urls(
+                cached_urls,
+                prefixes=['http://mydomain.external.com/images/'],
+                regexes=[r'\.css\?']),
+            [
+                'http://mydomain.external.com/images/a.png',
+                'http://mydomain.external.com/css/site.css?v=2'])
+        with self.assertRaises(re.error):
+            purge.select_urls([], regexes=['('])
+
+    def test_purge(self):
+        self.assertEqual(
+            purge.purge(
+                ['http://mydomain.external.com/index.html', '/missing'],
+                self.port,
+                'default.com'),
+            [
+                {'url': 'http://mydomain.external.com/index.html', 'status': 200},
+                {'url': '/missing', 'status': 404}])
+        self.assertEqual(
+            sorted(self.server.purged),
+            [
+                ('default.com', '/missing'),
+                ('mydomain.external.com', '/index.html')])
@@ -0,0 +1,88 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+import unittest
+
+import refresh_patterns
+
+
+def pattern(regex, ignore_case=False):
+    # A true case_sensitive renders -i on the relation.
+    return {
+        'regex': regex,
+        'case_sensitive': ignore_case,
+        'min': 0,
+        'percent': 20,
+        'max': 4320,
+        'options': []}
+
+
+class TestRefreshPatterns(unittest.TestCase):
+
+    def test_validate(self):
+        self.assertIsNone(refresh_patterns.validate(pattern('\\.png$')))
+        self.assertIn('invalid regex', refresh_patterns.validate(pattern('(unclosed')))
+        self.assertEqual(
+            refresh_patterns.validate(dict(pattern('a'), min=-1)),
+            'negative min')
+        self.assertEqual(
+            refresh_patterns.validate(dict(pattern('a'), max='lots')),
+            'max is not a number')
+        self.assertEqual(
+            refresh_patterns.validate({'regex': 'a', 'min': 0, 'percent': 0}),
+            'missing max')
+
+    def test_shadows(self):
+        shadows = refresh_patterns.shadows
+        self.assertTrue(shadows(pattern('.'), pattern('(/cgi-bin/|\\?)')))
+        self.assertTrue(shadows(pattern('^http://a/'), pattern('^http://a/b/')))
+        self.assertFalse(shadows(pattern('^http://a/b/'), pattern('^http://a/')))
+        self.assertTrue(shadows(pattern('\\.png$'), pattern('/logo\\.png$')))
+        self.assertTrue(shadows(pattern('/static/'), pattern('^http://a/static/x')))
+        self.assertFalse(shadows(pattern('\\.png$'), pattern('\\.png')))
+        # A case sensitive pattern doesn't shadow a case insensitive one.
+        self.assertFalse(shadows(pattern('\\.png$'), pattern('\\.png$', True)))
+        self.assertTrue(shadows(pattern('\\.PNG$', True), pattern('/a\\.png$')))
+        self.assertFalse(shadows(pattern('\\.p.g$'), pattern('\\.png$')))
+
+    def test_disjoint(self):
+        disjoint = refresh_patterns.disjoint
+        self.assertTrue(disjoint(pattern('\\.png$'), pattern('\\.css$')))
+        self.assertTrue(disjoint(pattern('^http://a/'), pattern('^http://b/')))
+        self.assertFalse(disjoint(pattern('\\.png$'), pattern('^http://a/')))
+        self.assertFalse(disjoint(pattern('\\.png$'), pattern('a\\.png$')))
+        self.assertFalse(disjoint(pattern('\\.png$'), pattern('(/cgi-bin/|\\?)')))
+
+    def test_optimise(self):
+        patterns, report = refresh_patterns.optimise([
+            pattern('\\.png$'),
+            pattern('(/cgi-bin/|\\?)'),
+            pattern('\\.css$'),
+            pattern('\\.png$'),
+            pattern('/logo\\.png$'),
+            pattern('[invalid'),
+            pattern('\\.js$'),
+        ], counts={'\\.js$': 100, '\\.css$': 50, '\\.png$': 10})
+        self.assertEqual(
+            [p['regex'] for p in patterns],
+            ['\\.png$', '(/cgi-bin/|\\?)', '\\.js$', '\\.css$'])
+        self.assertEqual(report['duplicate'], ['\\.png$'])
+        self.assertEqual(
+            report['shadowed'],
+            [{'regex': '/logo\\.png$', 'by': '\\.png$'}])
+        self.assertEqual(report['invalid'][0]['regex'], '[invalid')
+        self.assertTrue(report['reordered'])
+
+    def test_optimise_unchanged(self):
+        patterns = [pattern('\\.png$'), pattern('\\.css$')]
+        self.assertEqual(
+            refresh_patterns.optimise(patterns),
+            (patterns, {
+                'invalid': [], 'duplicate': [], 'shadowed': [], 'reordered': False}))
+
+    def test_count_matches(self):
+        self.assertEqual(
+            refresh_patterns.count_matches(
+                [pattern('\\.png$'), pattern('^http://a/'), pattern('\\.CSS$', True)],
+                ['http://a/x.png', 'http://a/y', 'http://b/z.css', 'http://b/']),
+            {'\\.png$': 1, '^http://a/': 1, '\\.CSS$': 1})
@@ -0,0 +1,81 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+import unittest
+
+import squid_metrics
+
+INFO_PAGE = """Squid Object Cache: Version 4.10
+Service Name: squid
+Connection information for squid:
+\tNumber of clients accessing cache:\t3
+\tNumber of HTTP requests received:\t1200
+Cache information for squid:
+\tHits as % of all requests:\t5min: 62.5%, 60min: 40.0%
+\tHits as % of bytes sent:\t5min: 55.0%, 60min: 35.1%
+\tMemory hits as % of hit requests:\t5min: 90.0%, 60min: 80.0%
+\tDisk hits as % of hit requests:\t5min: 10.0%, 60min: 20.0%
+\tStorage Swap size:\t1024 KB
+\tStorage Swap capacity:\t 0.1% used, 99.9% free
+\tStorage Mem size:\t216 KB
+\tMean Object Size:\t12.50 KB
+Median Service Times (seconds)  5 min    60 min:
+\tHTTP Requests (All):   0.00179  0.00091
+\tCache Misses:          0.01035  0.01035
+\tCache Hits:            0.00000  0.00000
+File descriptor usage for squid:
+\tMaximum number of file descriptors:   1024
+\tLargest file desc currently in use:     13
+\tNumber of file desc currently in use:    8
+"""
+
+COUNTERS_PAGE = """sample_time = 1623421234.123456 (Fri, 11 Jun 2021 14:20:34 GMT)
+client_http.requests = 1200
+client_http.hits = 600
+client_http.kbytes_out = 4096
+"""
+
+FIVE_MIN_PAGE = """sample_start_time = 1623420934.1 (Fri, 11 Jun 2021 14:15:34 GMT)
+sample_end_time = 1623421234.1 (Fri, 11 Jun 2021 14:20:34 GMT)
+client_http.requests = 4.000000/sec
+client_http.all_median_svc_time = 0.001790 seconds
+"""
+
+
+class TestSquidMetrics(unittest.TestCase):
+
+    def test_parse_info(self):
+        info = squid_metrics.parse_info(INFO_PAGE.splitlines())
+        self.assertEqual(info['squid_hit_ratio'], 0.625)
+        self.assertEqual(info['squid_byte_hit_ratio'], 0.55)
+        self.assertEqual(info['squid_disk_store_kilobytes'], 1024)
+        self.assertEqual(info['squid_memory_store_kilobytes'], 216)
+        self.assertEqual(info['squid_file_descriptors_max'], 1024)
+        self.assertEqual(info['squid_file_descriptors_in_use'], 8)
+        self.assertEqual(
+            info[('squid_median_service_time_seconds', 'misses')],
+            0.01035)
+
+    def test_parse_key_values(self):
+        self.assertEqual(
+            squid_metrics.parse_key_values(FIVE_MIN_PAGE.splitlines()),
+            {
+                'sample_start_time': 1623420934.1,
+                'sample_end_time': 1623421234.1,
+                'client_http.requests': 4.0,
+                'client_http.all_median_svc_time': 0.00179})
+
+    def test_format_metrics(self):
+        metrics = squid_metrics.format_metrics(
+            squid_metrics.parse_info(INFO_PAGE.splitlines()),
+            squid_metrics.parse_key_values(COUNTERS_PAGE.splitlines()),
+            squid_metrics.parse_key_values(FIVE_MIN_PAGE.splitlines()))
+        lines = metrics.splitlines()
+        self.assertIn('squid_hit_ratio 0.625', lines)
+        self.assertIn(
+            'squid_median_service_time_seconds{type="all"} 0.00179',
+            lines)
+        self.assertIn('squid_requests_per_second 4.0', lines)
+        self.assertIn('squid_client_http_requests_total 1200.0', lines)
+        self.assertIn('squid_5min_client_http_all_median_svc_time 0.00179', lines)
+        self.assertFalse([line for line in lines if 'sample' in line])
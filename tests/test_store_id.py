@@ -0,0 +1,60 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+import io
+import unittest
+from unittest.mock import patch
+
+import store_id
+
+
+class TestStoreId(unittest.TestCase):
+
+    def test_normalise_url_strip_params(self):
+        self.assertEqual(
+            store_id.normalise_url(
+                'http://example.com/a?utm_source=x&id=1&fbclid=2&utm_medium=y',
+                strip_params=['utm_*', 'fbclid']),
+            'http://example.com/a?id=1')
+        self.assertEqual(
+            store_id.normalise_url(
+                'http://example.com/a?utm_source=x',
+                strip_params=['utm_*']),
+            'http://example.com/a')
+
+    def test_normalise_url_sort_query(self):
+        self.assertEqual(
+            store_id.normalise_url(
+                'http://example.com/a?b=2&a=%20&a=1',
+                sort_query=True),
+            'http://example.com/a?a=%20&a=1&b=2')
+
+    def test_normalise_url_unchanged(self):
+        url = 'http://example.com/a?b=2&a=1'
+        self.assertEqual(store_id.normalise_url(url, ['utm_*']), url)
+        self.assertEqual(
+            store_id.normalise_url('http://example.com/', sort_query=True),
+            'http://example.com/')
+
+    def test_handle_line(self):
+        self.assertEqual(
+            store_id.handle_line(
+                '0 http://example.com/a?b=2&a=1 -\n', sort_query=True),
+            '0 OK store-id=http://example.com/a?a=1&b=2')
+        self.assertEqual(
+            store_id.handle_line('1 http://example.com/a\n', sort_query=True),
+            '1 ERR')
+        self.assertEqual(
+            store_id.handle_line('2\n'),
+            '2 BH message="malformed request"')
+
+    def test_main(self):
+        stdin = io.StringIO(
+            '0 http://example.com/?utm_source=x&q=1\n'
+            '1 http://example.com/?q=1\n')
+        stdout = io.StringIO()
+        with patch('sys.stdin', stdin), patch('sys.stdout', stdout):
+            store_id.main(['--strip-params', 'utm_*', '--sort-query'])
+        self.assertEqual(
+            stdout.getvalue(),
+            '0 OK store-id=http://example.com/?q=1\n1 ERR\n')
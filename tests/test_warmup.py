@@ -0,0 +1,115 @@
+# Copyright 2021 Canonical
+# See LICENSE file for licensing details.
+
+import http.server
+import threading
+import unittest
+
+import warmup
+
+SITEMAP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>http://mydomain.external.com/a.html</loc></url>
+  <url><loc>http://mydomain.external.com/b.html</loc></url>
+</urlset>
+"""
+
+SITEMAP_INDEX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>http://mydomain.external.com/sitemap.xml</loc></sitemap>
+</sitemapindex>
+"""
+
+
+class FakeSquidHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append((self.headers['Host'], self.path))
+        if self.path == '/missing':
+            self.send_response(404)
+            self.send_header('X-Cache', 'MISS from squid')
+            self.end_headers()
+            return
+        if self.path == '/sitemap.xml':
+            body = SITEMAP
+        elif self.path == '/sitemap-index.xml':
+            body = SITEMAP_INDEX
+        else:
+            body = b'x' * 100
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header(
+            'X-Cache',
+            'HIT from squid' if self.path.startswith('/a.html')
+            else 'MISS from squid')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestWarmup(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), FakeSquidHandler)
+        self.server.requests = []
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_fetch(self):
+        result = warmup.fetch(
+            'http://mydomain.external.com/a.html?x=1',
+            self.port,
+            'default.com')
+        self.assertEqual(result['status'], 200)
+        self.assertEqual(result['bytes'], 100)
+        self.assertEqual(result['result'], 'TCP_HIT')
+        self.assertEqual(
+            self.server.requests,
+            [('mydomain.external.com', '/a.html?x=1')])
+
+    def test_fetch_relative(self):
+        result = warmup.fetch('/missing', self.port, 'default.com')
+        self.assertEqual(result['status'], 404)
+        self.assertEqual(result['result'], 'TCP_MISS')
+        self.assertEqual(self.server.requests, [('default.com', '/missing')])
+
+    def test_fetch_error(self):
+        self.server.shutdown()
+        self.server.server_close()
+        result = warmup.fetch('/a.html', self.port, 'default.com', timeout=1)
+        self.assertIsNone(result['status'])
+        self.assertIn('error', result)
+
+    def test_get_sitemap_urls(self):
+        expected = [
+            'http://mydomain.external.com/a.html',
+            'http://mydomain.external.com/b.html']
+        self.assertEqual(
+            warmup.get_sitemap_urls('/sitemap.xml', self.port, 'default.com'),
+            expected)
+        self.assertEqual(
+            warmup.get_sitemap_urls(
+                '/sitemap-index.xml', self.port, 'default.com'),
+            expected)
+        with self.assertRaises(warmup.SitemapError):
+            warmup.get_sitemap_urls('/a.html', self.port, 'default.com')
+
+    def test_warm(self):
+        results = warmup.warm(
+            ['/a.html', '/b.html', '/missing'],
+            self.port,
+            'mydomain.external.com',
+            concurrency=2)
+        self.assertEqual(
+            [(r['url'], r['status'], r['result']) for r in results],
+            [
+                ('/a.html', 200, 'TCP_HIT'),
+                ('/b.html', 200, 'TCP_MISS'),
+                ('/missing', 404, 'TCP_MISS')])